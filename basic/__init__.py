@@ -1,20 +1,44 @@
 # flake8: noqa: F401
+import importlib
 
+from . import binary, jsonl, profiling
 from .args import ArgumentParser
 from .inspection import (class_type, lambda_guess_struct, guess_struct,
                          guess_type, convert)
-from .struct import struct, lambda_struct
+from .struct import struct, lambda_struct, evolve
 from .types import (Any, Int, Enum, Float, Str, Bool, Datetime, Path, Bytes,
                     List, Dict, DefaultDict, Tuple, Placeholder)
 from .utils import unflatten
 
-try:
-    from .mongo import ObjectId, BasicCursor, BasicCollection
-except ImportError:
-    pass
-try:
-    import torch
-except ImportError:
-    pass
-else:
-    from .torch import Tensor, FloatOrTensor
+# Names imported on first access, so that importing basic
+# does not import torch, numpy or bson.
+_LAZY_NAMES = {
+    "Tensor": ".torch",
+    "FloatOrTensor": ".torch",
+    "DirectoryStore": ".blobs",
+    "NDArray": ".numpy",
+    "ObjectId": ".mongo",
+    "BasicCursor": ".mongo",
+    "BasicCollection": ".mongo",
+    "AsyncBasicCursor": ".mongo",
+    "AsyncBasicCollection": ".mongo",
+    "MissingDocuments": ".mongo",
+}
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_NAMES[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        module = importlib.import_module(module_name, __name__)
+    except ImportError as error:
+        raise AttributeError(f"basic.{name} is not available: {error}")
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_NAMES))
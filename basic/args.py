@@ -1,5 +1,6 @@
 import functools
 import json
+import os
 import sys
 from pathlib import Path
 
@@ -7,13 +8,43 @@ from . import inspection, struct, types
 from .utils import unflatten
 
 _STR_TYPES = (str, Path)
+# Also given as is on the command line, matched by name to avoid
+# importing bson.
+_STR_TYPE_NAMES = {"bson.objectid.ObjectId"}
 
-try:
-    from bson.objectid import ObjectId
-except ImportError:
-    pass
-else:
-    _STR_TYPES += (ObjectId, )
+
+def _is_str_type(klass):
+    if issubclass(klass, _STR_TYPES):
+        return True
+    return any(f"{base.__module__}.{base.__qualname__}" in _STR_TYPE_NAMES
+               for base in klass.__mro__)
+
+
+# Parsed include files by absolute path, with their modification time and size.
+_INCLUDES = {}
+
+
+def _copy_json(value):
+    # Copy of parsed JSON, faster than `copy.deepcopy`.
+    if isinstance(value, dict):
+        return {key: _copy_json(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [_copy_json(item) for item in value]
+    return value
+
+
+def _load_include(path):
+    # Cached entries are copied, as they may end up as is in the parsed
+    # arguments, for instance in fields of type `Any`.
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _INCLUDES.get(path)
+    if cached is None or cached[0] != version:
+        with open(path) as file:
+            cached = (version, json.load(file))
+        _INCLUDES[path] = cached
+    return _copy_json(cached[1])
 
 
 class ArgumentParser:
@@ -31,6 +62,16 @@ class ArgumentParser:
         self.includes = includes
         self.use_eval = use_eval
 
+    @property
+    def type(self):
+        return self._type
+
+    @type.setter
+    def type(self, type):
+        self._type = type
+        # Types of the field paths looked up by `get_type`.
+        self._types = {}
+
     @staticmethod
     def _get_description(type_, name=None, indent=0):
         lines = []
@@ -60,12 +101,21 @@ class ArgumentParser:
         _print("\n".join(ArgumentParser._get_description(self.type)))
 
     def get_type(self, path):
-        type_ = self.type
-        for part in path.split("."):
-            type_ = type_._schema[part]
+        try:
+            return self._types[path]
+        except KeyError:
+            pass
+        parent, _, name = path.rpartition(".")
+        type_ = self.get_type(parent) if parent else self.type
+        type_ = type_._schema[name]
+        self._types[path] = type_
         return type_
 
     def argv_to_json(self, argv, out=None):
+        """
+        Include files are parsed once and cached, each call getting its own
+        copy of their values, which can be modified in place.
+        """
         args = {}
         if out is None:
             out = {}
@@ -78,14 +128,11 @@ class ArgumentParser:
             elif arg.startswith('@'):
                 if not self.includes:
                     raise ValueError("Include requested but is disallowed")
-                with open(arg[1:] + ".json") as file:
-                    entries = json.load(file)
-                for path, value in entries.items():
-                    args[path] = value
+                args.update(_load_include(arg[1:] + ".json"))
             elif "=" in arg:
                 path, value = arg.split('=', 1)
                 field = self.get_type(path)
-                if issubclass(field.klass, _STR_TYPES):
+                if _is_str_type(field.klass):
                     if value.startswith("@"):
                         value = value[1:]
                     else:
@@ -106,7 +153,7 @@ class ArgumentParser:
                     args[arg] = True
                 else:
                     args[arg] = {}
-        return unflatten(args, out)
+        return unflatten(args, out, copy=False)
 
     def parse_args(self, argv=None, convert=True):
         if argv is None:
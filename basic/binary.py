@@ -0,0 +1,629 @@
+# Compact binary format driven by the schema of basic types.
+#
+#   data = basic.binary.dumps(Document, document)
+#   document = basic.binary.loads(Document, data)
+#
+# Values are written in schema order without any field name: integers as
+# zigzag varints, floats as little endian doubles, str and bytes prefixed
+# by their length, structs as bitmaps of the fields set and of those set
+# to None followed by the other fields. Data starts with a fingerprint of
+# the schema, loading it with a different type raises a ValueError.
+#
+# Each type provides a `(write, read)` pair with `_binary_codec`:
+# `write(value, out)` appends the non None `value` to the bytearray `out`,
+# `read(data, pos)` returns the value at `pos` in the bytes `data`
+# and the position following it. Types without a specific encoding
+# are written as the tagged encoding of their JSON.
+import hashlib
+import struct as _struct
+
+from . import types
+
+_MAGIC = b"BSB1"
+_DOUBLE = _struct.Struct("<d")
+_NOVALUE = object()
+
+
+def write_uint(value, out):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_uint(data, pos):
+    byte = data[pos]
+    pos += 1
+    if byte < 0x80:
+        return byte, pos
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def write_int(value, out):
+    if not isinstance(value, int):
+        types.validate_class(value, int)
+    write_uint(value << 1 if value >= 0 else (~value << 1) | 1, out)
+
+
+def read_int(data, pos):
+    value, pos = read_uint(data, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def write_float(value, out):
+    if value.__class__ is not float:
+        value = types._to_float(value)
+    out += _DOUBLE.pack(value)
+
+
+def read_float(data, pos):
+    return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+
+
+def write_bytes(value, out):
+    write_uint(len(value), out)
+    out += value
+
+
+def read_bytes(data, pos):
+    size, pos = read_uint(data, pos)
+    end = pos + size
+    return data[pos:end], end
+
+
+def write_str(value, out):
+    if not isinstance(value, str):
+        types.validate_class(value, str)
+    write_bytes(value.encode("utf-8"), out)
+
+
+def read_str(data, pos):
+    size, pos = read_uint(data, pos)
+    end = pos + size
+    return data[pos:end].decode("utf-8"), end
+
+
+def write_bool(value, out):
+    out.append(1 if types.validate_class(value, bool) else 0)
+
+
+def read_bool(data, pos):
+    return data[pos] != 0, pos + 1
+
+
+INT = (write_int, read_int)
+FLOAT = (write_float, read_float)
+STR = (write_str, read_str)
+BOOL = (write_bool, read_bool)
+BYTES = (lambda value, out: write_bytes(
+    types.validate_class(value, bytes), out), read_bytes)
+
+# Tags of the values of `Any`.
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _BYTES, _LIST, _DICT = range(9)
+
+
+def write_any(value, out):
+    if value is None:
+        out.append(_NONE)
+    elif value is True or value is False:
+        out.append(_TRUE if value else _FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        write_int(value, out)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        out.append(_STR)
+        write_str(value, out)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(_BYTES)
+        write_bytes(value, out)
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        write_uint(len(value), out)
+        for item in value:
+            write_any(item, out)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        write_uint(len(value), out)
+        for key, item in value.items():
+            write_any(key, out)
+            write_any(item, out)
+    else:
+        raise TypeError(f"Cannot write {value!r} in binary format")
+
+
+def read_any(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    elif tag == _FALSE or tag == _TRUE:
+        return tag == _TRUE, pos
+    elif tag == _INT:
+        return read_int(data, pos)
+    elif tag == _FLOAT:
+        return read_float(data, pos)
+    elif tag == _STR:
+        return read_str(data, pos)
+    elif tag == _BYTES:
+        return read_bytes(data, pos)
+    size, pos = read_uint(data, pos)
+    if tag == _LIST:
+        items = []
+        for _ in range(size):
+            item, pos = read_any(data, pos)
+            items.append(item)
+        return items, pos
+    elif tag == _DICT:
+        items = {}
+        for _ in range(size):
+            key, pos = read_any(data, pos)
+            items[key], pos = read_any(data, pos)
+        return items, pos
+    raise ValueError(f"Invalid binary tag {tag}")
+
+
+ANY = (write_any, read_any)
+
+
+def mapped(codec, encode, decode):
+    """
+    Codec writing `encode(value)` with `codec` and reading back
+    `decode(item)`.
+    """
+    write, read = codec
+
+    def write_mapped(value, out):
+        write(encode(value), out)
+
+    def read_mapped(data, pos):
+        item, pos = read(data, pos)
+        return decode(item), pos
+
+    return write_mapped, read_mapped
+
+
+def json_codec(type_):
+    # Fallback for types without a binary encoding.
+    return mapped(ANY, type_.compile(types.JSON).to_jsony,
+                  type_.compile(types.JSON).from_jsony)
+
+
+def codec(type_):
+    """
+    Return the `(write, read)` pair of `type_`, cached on the type.
+    """
+    try:
+        return type_._compiled["binary"]
+    except KeyError:
+        pass
+    pair = type_._binary_codec()
+    type_._compiled["binary"] = pair
+    return pair
+
+
+def _bitmap_size(count):
+    return (count + 7) // 8
+
+
+def _write_nones(items, out):
+    # Write the length of `items` and a bitmap of its None items if any,
+    # return the items to write.
+    indices = [index for index, item in enumerate(items) if item is None]
+    if not indices:
+        write_uint(len(items) << 1, out)
+        return items
+    write_uint(len(items) << 1 | 1, out)
+    nones = sum(1 << index for index in indices)
+    out += nones.to_bytes(_bitmap_size(len(items)), "little")
+    return [item for item in items if item is not None]
+
+
+def _read_nones(data, pos):
+    # Return the length, bitmap of None items and position of the items.
+    header, pos = read_uint(data, pos)
+    size = header >> 1
+    if not header & 1:
+        return size, 0, pos
+    end = pos + _bitmap_size(size)
+    return size, int.from_bytes(data[pos:end], "little"), end
+
+
+def _read_items(read, size, nones, data, pos):
+    items = []
+    for index in range(size):
+        if nones >> index & 1:
+            items.append(None)
+        else:
+            item, pos = read(data, pos)
+            items.append(item)
+    return items, pos
+
+
+def list_codec(item_type):
+    write_item, read_item = codec(item_type)
+    packed = isinstance(item_type, types._Float)
+
+    def write(value, out):
+        items = _write_nones(value, out)
+        if packed:
+            # Checked as by `write_float`, which `_struct.pack` does not do.
+            if any(item.__class__ is not float for item in items):
+                items = [types._to_float(item) for item in items]
+            out += _struct.pack(f"<{len(items)}d", *items)
+            return
+        for item in items:
+            write_item(item, out)
+
+    def read(data, pos):
+        size, nones, pos = _read_nones(data, pos)
+        if packed and not nones:
+            end = pos + 8 * size
+            return list(_struct.unpack_from(f"<{size}d", data, pos)), end
+        elif packed:
+            count = size - bin(nones).count("1")
+            items = iter(_struct.unpack_from(f"<{count}d", data, pos))
+            pos += 8 * count
+            return [
+                None if nones >> index & 1 else next(items)
+                for index in range(size)
+            ], pos
+        return _read_items(read_item, size, nones, data, pos)
+
+    return write, read
+
+
+def dict_codec(key_type, value_type):
+    write_key, read_key = codec(key_type)
+    write_value, read_value = codec(value_type)
+
+    def write(value, out):
+        values = _write_nones(list(value.values()), out)
+        for key in value:
+            write_key(key, out)
+        for item in values:
+            write_value(item, out)
+
+    def read(data, pos):
+        size, nones, pos = _read_nones(data, pos)
+        keys = []
+        for _ in range(size):
+            key, pos = read_key(data, pos)
+            keys.append(key)
+        values, pos = _read_items(read_value, size, nones, data, pos)
+        return dict(zip(keys, values)), pos
+
+    return write, read
+
+
+def tuple_codec(item_types):
+    codecs = [codec(item_type) for item_type in item_types]
+    size = len(codecs)
+
+    def write(value, out):
+        if len(value) != size:
+            raise ValueError(f"Expected tuple of length {size} "
+                             f"but got {len(value)}")
+        _write_nones(list(value), out)
+        for (write_item, _), item in zip(codecs, value):
+            if item is not None:
+                write_item(item, out)
+
+    def read(data, pos):
+        _, nones, pos = _read_nones(data, pos)
+        items = []
+        for index, (_, read_item) in enumerate(codecs):
+            if nones >> index & 1:
+                items.append(None)
+            else:
+                item, pos = read_item(data, pos)
+                items.append(item)
+        return tuple(items), pos
+
+    return write, read
+
+
+# Lines writing `item`, and reading into `dest`, for the most common leaf
+# codecs, inlined in the generated struct codecs.
+_INLINE_WRITES = {
+    INT: [
+        "if item.__class__ is not int:",
+        "    _validate(item, int)",
+        "if 0 <= item < 64:",
+        "    out.append(item << 1)",
+        "else:",
+        "    _write_int(item, out)",
+    ],
+    FLOAT: [
+        "if item.__class__ is not float:",
+        "    item = _to_float(item)",
+        "out += _pack_double(item)",
+    ],
+    STR: [
+        "if item.__class__ is not str:",
+        "    _validate(item, str)",
+        "item = item.encode('utf-8')",
+        "if len(item) < 128:",
+        "    out.append(len(item))",
+        "else:",
+        "    _write_uint(len(item), out)",
+        "out += item",
+    ],
+}
+_INLINE_READS = {
+    INT: [
+        "item = data[pos]",
+        "if item < 128:",
+        "    {dest} = (item >> 1) ^ -(item & 1)",
+        "    pos += 1",
+        "else:",
+        "    {dest}, pos = _read_int(data, pos)",
+    ],
+    FLOAT: [
+        "{dest} = _unpack_double(data, pos)[0]",
+        "pos += 8",
+    ],
+    STR: [
+        "size = data[pos]",
+        "if size < 128:",
+        "    pos += 1",
+        "else:",
+        "    size, pos = _read_uint(data, pos)",
+        "{dest} = data[pos:pos + size].decode('utf-8')",
+        "pos += size",
+    ],
+    BOOL: [
+        "{dest} = data[pos] != 0",
+        "pos += 1",
+    ],
+}
+
+
+# Fixed size codecs, written together at the start of structs.
+_FIXED = {FLOAT: "d", BOOL: "?"}
+
+
+def _bitmap_line(name, offset, size):
+    if size == 1:
+        return f"{name} = data[pos + {offset}]"
+    return (f"{name} = int.from_bytes(data[pos + {offset}:"
+            f"pos + {offset + size}], 'little')")
+
+
+def struct_codec(schema, build):
+    """
+    Codec of structs of `schema`, read structs are built by calling
+    `build` with the dict of their fields. The code is generated for each
+    schema, like the compiled JSON and BSON codecs of structs.
+    Floats and bools are written first, packed together when all set.
+    Writing a struct with fields not in `schema` raises a KeyError.
+    """
+    from .struct import _unknown_field
+    size = _bitmap_size(len(schema))
+    fields = []
+    for index, (name, type_) in enumerate(schema.items()):
+        fields.append((index, name, codec(type_)))
+    fixed = [field for field in fields if field[2] in _FIXED]
+    variable = [field for field in fields if field[2] not in _FIXED]
+    fixed_mask = sum(1 << index for index, _, _ in fixed)
+    packed = _struct.Struct(
+        "<" + "".join(_FIXED[pair] for _, _, pair in fixed))
+    namespace = {
+        "_NOVALUE": _NOVALUE,
+        "_build": build,
+        "_validate": types.validate_class,
+        "_to_float": types._to_float,
+        "_pack": packed.pack,
+        "_unpack": packed.unpack_from,
+        "_pack_double": _DOUBLE.pack,
+        "_unpack_double": _DOUBLE.unpack_from,
+        "_write_int": write_int,
+        "_read_int": read_int,
+        "_write_uint": write_uint,
+        "_read_uint": read_uint,
+        "_zeros": bytes(2 * size),
+        "_schema": schema,
+        "_unknown_field": _unknown_field,
+    }
+    for index, _, (write_field, read_field) in fields:
+        namespace[f"_write_{index}"] = write_field
+        namespace[f"_read_{index}"] = read_field
+
+    # The bitmaps are reserved then filled once the fields are written.
+    write = [
+        "def write(value, out):",
+        "    fields = value._load()",
+        "    start = len(out)",
+        "    out += _zeros",
+        "    present = nones = 0",
+    ]
+    for index, name, _ in fields:
+        write += [
+            f"    item_{index} = fields.get({name!r}, _NOVALUE)",
+            f"    if item_{index} is not _NOVALUE:",
+            f"        present |= {1 << index}",
+            f"        if item_{index} is None:",
+            f"            nones |= {1 << index}",
+        ]
+    if fixed:
+        arguments = ", ".join(f"item_{index}" for index, _, _ in fixed)
+        write += [
+            f"    if present & {fixed_mask} == {fixed_mask} "
+            f"and not nones & {fixed_mask}:",
+        ]
+        # Checked as by `write_float` and `write_bool`, which `_pack`
+        # does not do.
+        for index, _, pair in fixed:
+            if pair is FLOAT:
+                write += [
+                    f"        if item_{index}.__class__ is not float:",
+                    f"            item_{index} = _to_float(item_{index})",
+                ]
+            else:
+                write += [
+                    f"        if item_{index}.__class__ is not bool:",
+                    f"            _validate(item_{index}, bool)",
+                ]
+        write += [
+            f"        out += _pack({arguments})",
+            "    else:",
+        ]
+        for index, _, _ in fixed:
+            write += [
+                f"        if present & {1 << index} "
+                f"and not nones & {1 << index}:",
+                f"            _write_{index}(item_{index}, out)",
+            ]
+    for index, _, pair in variable:
+        lines = _INLINE_WRITES.get(pair, [f"_write_{index}(item, out)"])
+        write += [
+            f"    if present & {1 << index} and not nones & {1 << index}:",
+            f"        item = item_{index}",
+        ] + [" " * 8 + line for line in lines]
+    full = (1 << len(fields)) - 1
+    write += [
+        f"    if len(fields) != ({len(fields)} if present == {full} "
+        "else bin(present).count('1')):",
+        "        _unknown_field(fields, _schema)",
+        f"    out[start:start + {size}] = present.to_bytes({size}, 'little')",
+        f"    out[start + {size}:start + {2 * size}] = "
+        f"nones.to_bytes({size}, 'little')",
+    ]
+
+    # Fields are read into locals, then put in schema order.
+    read = [
+        "def read(data, pos):",
+        "    " + _bitmap_line("present", 0, size),
+        "    " + _bitmap_line("nones", size, size),
+        f"    pos += {2 * size}",
+    ]
+    if fixed:
+        read += [
+            f"    if present & {fixed_mask} == {fixed_mask} "
+            f"and not nones & {fixed_mask}:",
+            "        " + ", ".join(f"item_{index}"
+                                   for index, _, _ in fixed) +
+            ", = _unpack(data, pos)",
+            f"        pos += {packed.size}",
+            "    else:",
+        ]
+        for index, _, _ in fixed:
+            read += [
+                f"        if not present & {1 << index}:",
+                f"            item_{index} = _NOVALUE",
+                f"        elif nones & {1 << index}:",
+                f"            item_{index} = None",
+                "        else:",
+                f"            item_{index}, pos = _read_{index}(data, pos)",
+            ]
+    for index, _, pair in variable:
+        lines = _INLINE_READS.get(
+            pair, ["{dest}, pos = _read_%d(data, pos)" % index])
+        read += [
+            f"    if not present & {1 << index}:",
+            f"        item_{index} = _NOVALUE",
+            f"    elif nones & {1 << index}:",
+            f"        item_{index} = None",
+            "    else:",
+        ] + [" " * 8 + line.format(dest=f"item_{index}") for line in lines]
+    read += [
+        f"    if present == {full}:",
+        "        fields = {" + ", ".join(
+            f"{name!r}: item_{index}" for index, name, _ in fields) + "}",
+        "    else:",
+        "        fields = {}",
+    ]
+    for index, name, _ in fields:
+        read += [
+            f"        if item_{index} is not _NOVALUE:",
+            f"            fields[{name!r}] = item_{index}",
+        ]
+    read.append("    return _build(fields), pos")
+    exec("\n".join(write + read), namespace)
+    return namespace["write"], namespace["read"]
+
+
+def _describe(type_):
+    # Description of the layout of `type_`, hashed into the fingerprint.
+    from .struct import StructType
+    if isinstance(type_, types.Placeholder):
+        return f"Placeholder({type_._name})"
+    elif isinstance(type_, StructType):
+        fields = ",".join(f"{name}:{_describe(field)}"
+                          for name, field in type_._schema.items())
+        return f"{type_.name}({fields})"
+    elif isinstance(type_, types.TemplateType):
+        if type_._parameters is None:
+            return type_.base_name
+        parameters = ",".join(_describe(p) for p in type_._parameters)
+        return f"{type_.base_name}[{parameters}]"
+    elif isinstance(type_, types.Enum):
+        values = ",".join(f"{item.name}={item.value}"
+                          for item in type_.klass)
+        return f"{type_.name}({values})"
+    return type_.name
+
+
+def fingerprint(type_):
+    return hashlib.blake2b(
+        _describe(type_).encode("utf-8"), digest_size=8).digest()
+
+
+def _compile(type_):
+    # Codec of `type_.compile(BINARY)`, between values and bytes.
+    write, read = codec(type_)
+    header = _MAGIC + fingerprint(type_)
+    start = len(header) + 1
+
+    def dumps(value):
+        out = bytearray(header)
+        if value is None:
+            out.append(0)
+        else:
+            out.append(1)
+            write(value, out)
+        return bytes(out)
+
+    def loads(data):
+        if data is None:
+            return None
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        if not data.startswith(header):
+            raise ValueError(
+                f"Data was not written in binary format as {type_.name}")
+        if not data[start - 1]:
+            return None
+        try:
+            value, pos = read(data, start)
+        except (IndexError, _struct.error):
+            raise ValueError("Truncated binary data") from None
+        if pos > len(data):
+            raise ValueError("Truncated binary data")
+        if pos != len(data):
+            raise ValueError(f"{len(data) - pos} bytes of trailing data")
+        return value
+
+    return types.Codec(dumps, loads)
+
+
+def dumps(type_, value):
+    return type_.compile(types.BINARY).to_jsony(value)
+
+
+def loads(type_, data):
+    """
+    Arrays, and tensors of `Tensor.shared`, share the memory of `data`,
+    which is copied first if it is not `bytes`.
+    """
+    return type_.compile(types.BINARY).from_jsony(data)
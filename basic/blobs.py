@@ -0,0 +1,129 @@
+# Storage of large values out of documents, see `Bytes.external`
+# and `Tensor.external`.
+#
+#   store = basic.DirectoryStore("/data/blobs")
+#   Sample = basic.struct("Sample", image=basic.Tensor.external(store))
+#
+# Values are written once to content addressed `.npy` files, documents
+# only keeping a reference with the hash, shape and dtype of the array:
+#
+#   {"blob": "9f86d0...", "shape": [3, 224, 224], "dtype": "<f4"}
+#
+# Decoding memory maps the file, so that no data is read until it is
+# accessed and processes reading the same blob share its pages. Mappings
+# are copy on write, values can be modified without changing the blob.
+import hashlib
+import io
+import os
+from pathlib import Path
+import secrets
+
+import numpy as np
+from numpy.lib import format as npy
+
+from .types import validate_class
+
+
+class DirectoryStore:
+    """
+    Blobs stored as `.npy` files named after the SHA-256 of their content
+    in a local directory, possibly shared by several processes.
+    """
+
+    def __init__(self, path):
+        self._path = Path(path)
+
+    @property
+    def path(self):
+        return self._path
+
+    def blob_path(self, digest):
+        return self._path / digest[:2] / f"{digest[2:]}.npy"
+
+    def put(self, array):
+        """
+        Write `array` if not already stored and return its hash.
+        """
+        if not array.flags.c_contiguous:
+            array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise ValueError(f"Cannot store arrays of {array.dtype}")
+        header = io.BytesIO()
+        npy.write_array_header_2_0(header,
+                                   npy.header_data_from_array_1_0(array))
+        header = header.getvalue()
+        data = array.reshape(-1).view(np.uint8).data
+        digest = hashlib.sha256(header)
+        digest.update(data)
+        digest = digest.hexdigest()
+
+        path = self.blob_path(digest)
+        if path.exists():
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name so that readers never see
+        # a partial blob. Unlike with `tempfile.mkstemp`, the permissions
+        # are those of regular files, so that other users can read
+        # a shared store.
+        temporary = path.with_name(f"{path.name}.{secrets.token_hex(8)}.tmp")
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(
+            os, "O_BINARY", 0)
+        descriptor = os.open(temporary, flags, 0o666)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(header)
+                file.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return digest
+
+    def open(self, digest):
+        """
+        Return the memory mapped array of a blob, whose writes are kept
+        private to the array.
+        """
+        return np.load(self.blob_path(digest), mmap_mode="c")
+
+    def __eq__(self, other):
+        if not isinstance(other, DirectoryStore):
+            return False
+        return self._path == other._path
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return hash(self._path)
+
+    def __repr__(self):
+        return f"DirectoryStore({str(self._path)!r})"
+
+
+def dump(store, value):
+    """
+    Store `value`, an array or a bytes-like object, and return its reference.
+    """
+    if not isinstance(value, np.ndarray):
+        value = np.frombuffer(value, dtype=np.uint8)
+    return {
+        "blob": store.put(value),
+        "shape": list(value.shape),
+        "dtype": value.dtype.str,
+    }
+
+
+def load(store, reference):
+    """
+    Return the memory mapped array of a reference returned by `dump`.
+    """
+    validate_class(reference, dict)
+    array = store.open(validate_class(reference["blob"], str))
+    if (list(array.shape) != reference["shape"]
+            or array.dtype.str != reference["dtype"]):
+        raise ValueError(
+            f"Blob {reference['blob']} has shape {list(array.shape)} and "
+            f"dtype {array.dtype.str}, expected {reference['shape']} "
+            f"and {reference['dtype']}")
+    return array
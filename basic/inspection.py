@@ -1,13 +1,134 @@
+import importlib
 import inspect
 from inspect import Parameter
 import typing
+import weakref
 
 from . import types, struct
 
-POSSIBLE_TYPES = [
-    types.Bool, types.Int, types.Float, types.Tuple, types.List, types.Dict,
-    types.Path, types.Datetime, types.Str, types.Bytes
-]
+# Basic type used by `guess_type` for each registered class.
+_REGISTERED_TYPES = {}
+# Modules registering the type of a class, given by its full name,
+# imported only when the class is met.
+_LAZY_TYPES = {
+    "bson.objectid.ObjectId": "basic.mongo",
+    "numpy.ndarray": "basic.numpy",
+}
+# Cache of the registered type found in the MRO of a class, or None.
+_GUESSED_TYPES = weakref.WeakKeyDictionary()
+# The cache of `class_type` for a class, by extra arguments, is stored in
+# this attribute of the class, as the cached types reference their class.
+_CACHE_ATTRIBUTE = "_basic_class_types"
+# Classes with a cache attribute, and caches of the classes which
+# do not accept new attributes.
+_CACHED_CLASSES = weakref.WeakSet()
+_CLASS_TYPES = {}
+
+
+class _PossibleTypes(list):
+    """
+    Registered types, kept for compatibility. Types added to this list
+    are registered with `register_type`.
+    """
+
+    def append(self, basic_type):
+        register_type(basic_type)
+
+    def extend(self, basic_types):
+        for basic_type in basic_types:
+            register_type(basic_type)
+
+    def insert(self, index, basic_type):
+        register_type(basic_type)
+
+    def __iadd__(self, basic_types):
+        self.extend(basic_types)
+        return self
+
+
+POSSIBLE_TYPES = _PossibleTypes()
+
+
+def register_type(basic_type):
+    """
+    Make `guess_type` use `basic_type` for its class and the classes
+    inheriting from it.
+    """
+    _REGISTERED_TYPES[basic_type.klass] = basic_type
+    list.append(POSSIBLE_TYPES, basic_type)
+    _GUESSED_TYPES.clear()
+    clear_cache()
+
+
+def clear_cache(klass=None):
+    """
+    Forget the types built by `class_type` for `klass`, or for all classes.
+    """
+    if klass is None:
+        for cached in list(_CACHED_CLASSES):
+            delattr(cached, _CACHE_ATTRIBUTE)
+        _CACHED_CLASSES.clear()
+        _CLASS_TYPES.clear()
+    elif klass in _CACHED_CLASSES:
+        delattr(klass, _CACHE_ATTRIBUTE)
+        _CACHED_CLASSES.discard(klass)
+    else:
+        _CLASS_TYPES.pop(klass, None)
+
+
+def _class_cache(klass):
+    cache = vars(klass).get(_CACHE_ATTRIBUTE)
+    if cache is None:
+        cache = _CLASS_TYPES.get(klass)
+    if cache is None:
+        cache = {}
+        try:
+            setattr(klass, _CACHE_ATTRIBUTE, cache)
+            _CACHED_CLASSES.add(klass)
+        except (AttributeError, TypeError):
+            # Builtin and extension classes, which are never freed.
+            _CLASS_TYPES[klass] = cache
+    return cache
+
+
+def _registered_type(klass):
+    try:
+        return _GUESSED_TYPES[klass]
+    except KeyError:
+        pass
+    basic_type = None
+    for base in klass.__mro__:
+        module = _LAZY_TYPES.pop(f"{base.__module__}.{base.__qualname__}",
+                                 None)
+        if module is not None:
+            importlib.import_module(module)
+        if base in _REGISTERED_TYPES:
+            basic_type = _REGISTERED_TYPES[base]
+            break
+    _GUESSED_TYPES[klass] = basic_type
+    return basic_type
+
+
+class _ByIdentity:
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return self.value is other.value
+
+
+def _extra_key(extra):
+    key = []
+    for name, value in sorted(extra.items()):
+        try:
+            hash(value)
+        except TypeError:
+            value = _ByIdentity(value)
+        key.append((name, value.__class__, value))
+    return tuple(key)
 
 
 class ClassType(struct.StructType):
@@ -24,7 +145,7 @@ class ClassType(struct.StructType):
 
     def get_args_kwargs(self, value):
         args = []
-        kwargs = dict(value._fields)
+        kwargs = dict(value._load())
         if self._args_name is not None:
             args = kwargs.pop(self._args_name)
         if self._kwargs_name is not None:
@@ -35,16 +156,16 @@ class ClassType(struct.StructType):
         args, kwargs = self.get_args_kwargs(value)
         return self._convert_class(*args, **kwargs)
 
-    def convert(self, value):
-        return convert(self, value)
+    def convert(self, value, inplace=False):
+        return convert(self, value, inplace)
 
-    def _apply(self, value, func):
+    def _is_convertible(self):
+        return (self._convert_class is not None
+                or super(ClassType, self)._is_convertible())
+
+    def _apply(self, value, func, prune, inplace):
         if isinstance(value, struct.Struct):
-            kwargs = {
-                name: self.field(name).apply(field, func)
-                for name, field in value._fields.items()
-            }
-            return func(self, self._factory(**kwargs))
+            return super(ClassType, self)._apply(value, func, prune, inplace)
         else:
             return func(self, value)
 
@@ -89,7 +210,7 @@ def _parameter_type(parameter, extra=None):
 
     if parameter.annotation is not Parameter.empty:
         type_ = parameter.annotation
-    elif default not in [None, types.MISSING]:
+    elif default is not None and default is not types.MISSING:
         type_ = type(default)
     if parameter.kind == Parameter.VAR_KEYWORD:
         if type_ is None:
@@ -132,7 +253,19 @@ def _init_schema(init, klass=None, extra={}):
 
 
 def class_type(klass, **extra):
-    return _init_schema(klass.__init__, klass, extra=extra).empty
+    """
+    Build the struct type matching the constructor of `klass`,
+    cached by class and `extra`, see `clear_cache`.
+    """
+    key = _extra_key(extra)
+    cache = _class_cache(klass)
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    type_ = _init_schema(klass.__init__, klass, extra=extra).empty
+    cache[key] = type_
+    return type_
 
 
 def guess_type(value):
@@ -157,12 +290,7 @@ def guess_type(value):
     else:
         type_ = type(value)
 
-    basic_type = None
-    for possible_type in POSSIBLE_TYPES:
-        if issubclass(type_, possible_type.klass):
-            basic_type = possible_type
-            break
-
+    basic_type = _registered_type(type_)
     if basic_type is None:
         basic_type = class_type(type_)
 
@@ -171,15 +299,35 @@ def guess_type(value):
     return basic_type
 
 
-def convert(basic_type, value):
-    def _transform(sub_type, sub_value):
-        if (isinstance(sub_type, ClassType)
-                and isinstance(sub_value, struct.Struct)
-                and sub_type._convert_class is not None):
-            return sub_type._convert(sub_value)
-        return sub_value
+for _type in [
+        types.Bool, types.Int, types.Float, types.Tuple, types.List,
+        types.Dict, types.Path, types.Datetime, types.Str, types.Bytes
+]:
+    register_type(_type)
+del _type
+
+
+def _transform(sub_type, sub_value):
+    if (isinstance(sub_type, ClassType)
+            and isinstance(sub_value, struct.Struct)
+            and sub_type._convert_class is not None):
+        return sub_type._convert(sub_value)
+    return sub_value
+
+
+def _not_convertible(sub_type):
+    return not sub_type._convertible
+
 
-    return basic_type.apply(value, _transform)
+def convert(basic_type, value, inplace=False):
+    """
+    Replace the structs of class types in `value` by instances of their
+    classes. Parts of `value` that cannot contain such structs are kept
+    as is, and with `inplace` the containers of `value` are reused.
+    Only use `inplace` when `value` shares no container with another
+    value, such as the defaults of `basic_type`.
+    """
+    return basic_type.apply(value, _transform, _not_convertible, inplace)
 
 
 def lambda_guess_struct(__name=None, **schema):
@@ -0,0 +1,68 @@
+# Streaming of JSON Lines files, each line being a record of a basic type.
+# Paths ending in `.gz` are gzip compressed unless `compress` is given.
+import gzip
+import json
+
+from . import types
+
+BUFFER_SIZE = 1 << 20
+
+
+def _open(path, mode, compress):
+    if compress is None:
+        compress = str(path).endswith(".gz")
+    if compress:
+        return gzip.open(path, mode)
+    return open(path, mode, buffering=BUFFER_SIZE)
+
+
+def iter_load(path,
+              type,
+              offset=0,
+              compress=None,
+              with_offset=False,
+              trusted=False):
+    """
+    Iterate over the records stored in `path`, decoded with `type`,
+    starting at the byte `offset` (in the uncompressed stream).
+    If `with_offset` is True, yield `(offset, value)` pairs, `offset` being
+    the position right after the record, from which reading can resume.
+    `trusted=True` skips validation for files written by `dump`.
+    """
+    from_json = type.compile(types.JSON, trusted).from_jsony
+    with _open(path, "rb", compress) as file:
+        if offset:
+            file.seek(offset)
+        for line in file:
+            offset += len(line)
+            if line.isspace():
+                continue
+            value = from_json(json.loads(line))
+            if with_offset:
+                yield offset, value
+            else:
+                yield value
+
+
+def dump(path, type, values, compress=None, append=False):
+    """
+    Write each item of the iterable `values`, encoded with `type`,
+    as one line of `path`. Return the number of records written.
+    """
+    to_json = type.compile(types.JSON).to_jsony
+    count = 0
+    size = 0
+    lines = []
+    with _open(path, "ab" if append else "wb", compress) as file:
+        for value in values:
+            line = json.dumps(to_json(value), separators=(",", ":"))
+            line = line.encode("utf-8") + b"\n"
+            lines.append(line)
+            size += len(line)
+            count += 1
+            if size >= BUFFER_SIZE:
+                file.write(b"".join(lines))
+                lines.clear()
+                size = 0
+        file.write(b"".join(lines))
+    return count
@@ -1,6 +1,13 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+
 from bson import objectid
 
 from . import inspection, types
+from .struct import StructType
 
 
 class _ObjectId(types.BasicType):
@@ -23,24 +30,355 @@ class _ObjectId(types.BasicType):
         else:
             raise ValueError(f"Unsupported target {target}")
 
+    def _encoder(self, target):
+        if target is types.BSON:
+            return types._Identity(objectid.ObjectId)
+        return super(_ObjectId, self)._encoder(target)
+
+    def _decoder(self, source):
+        if source is types.BSON:
+            return types._Identity(objectid.ObjectId)
+        return super(_ObjectId, self)._decoder(source)
+
+    def _binary_codec(self):
+        def write(value, out):
+            out += types.validate_class(value, objectid.ObjectId).binary
+
+        def read(data, pos):
+            end = pos + 12
+            return objectid.ObjectId(bytes(data[pos:end])), end
+
+        return write, read
+
 
 ObjectId = _ObjectId()
-inspection.POSSIBLE_TYPES.append(ObjectId)
+inspection.register_type(ObjectId)
+
+
+class _InsertManyResult:
+    # Result of chunked inserts when pymongo is not installed.
+    def __init__(self, inserted_ids, acknowledged):
+        self.inserted_ids = inserted_ids
+        self.acknowledged = acknowledged
+
+
+def _insert_many_result(inserted_ids, acknowledged):
+    # Imported when needed, so that collections other than those of
+    # pymongo, such as in process fakes, do not require it.
+    try:
+        from pymongo.results import InsertManyResult
+    except ImportError:
+        InsertManyResult = _InsertManyResult
+    return InsertManyResult(inserted_ids, acknowledged)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _prefetch(iterable, size):
+    # Iterate over `iterable` from a background thread,
+    # keeping up to `size` items ready.
+    items = queue.Queue(size)
+    stop = threading.Event()
+
+    def put(kind, item=None):
+        while not stop.is_set():
+            try:
+                items.put((kind, item), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put("item", item):
+                    return
+        except BaseException as error:
+            put("error", error)
+        else:
+            put("end")
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            kind, item = items.get()
+            if kind == "end":
+                return
+            elif kind == "error":
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _map_ordered(func, iterable, workers):
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class MissingDocuments(LookupError):
+    def __init__(self, ids):
+        super(MissingDocuments, self).__init__(
+            f"{len(ids)} documents not found: {ids!r}")
+        self.ids = ids
+
+
+def _refresh_documents(ids_to_documents, results, decoders):
+    for result in results:
+        document = ids_to_documents.pop(result["_id"])
+        for key, value in result.items():
+            name, decode = decoders[key]
+            document._refresh_field(name, decode(value))
+
+
+# Query operators whose field names cannot be translated to stored keys.
+_UNTRANSLATABLE = ("$expr", "$where", "$jsonSchema")
+
+
+def _operators(value):
+    return (isinstance(value, dict) and bool(value)
+            and all(key.startswith("$") for key in value))
+
+
+def _resolved(type):
+    while isinstance(type, types.Placeholder):
+        type = type._type
+    return type
+
+
+def _stored_query(type, query):
+    # Filter or projection with its field paths translated to the keys
+    # stored in documents, see `StructType.stored_path`, including those
+    # of embedded documents and `$elemMatch`. Raise a ValueError for
+    # queries whose fields cannot be translated. Other values, such as
+    # an `_id` given as filter, are kept as is.
+    if not isinstance(query, (dict, list, tuple)) or not type._aliased:
+        return query
+    type = _resolved(type)
+    if not isinstance(type, StructType):
+        raise ValueError(f"Cannot translate the fields of a query "
+                         f"on {type.name} to their stored keys")
+    if not isinstance(query, dict):
+        return [type.stored_path(path) for path in query]
+    stored = {}
+    for key, value in query.items():
+        if key in ("$and", "$or", "$nor"):
+            stored[key] = [_stored_query(type, item) for item in value]
+        elif key in _UNTRANSLATABLE:
+            raise ValueError(f"Cannot translate the fields of {key} "
+                             f"to their stored keys")
+        elif key.startswith("$"):
+            stored[key] = value
+        else:
+            path, field_type = type._stored_path_type(key)
+            stored[path] = _stored_condition(field_type, value)
+    return stored
+
+
+def _stored_condition(type, condition):
+    # Condition, or projection, on a field of `type`, None if unknown.
+    if type is None or not type._aliased:
+        return condition
+    if not _operators(condition):
+        return _stored_value(type, condition)
+    stored = {}
+    for operator, value in condition.items():
+        if operator == "$elemMatch":
+            item_type = _resolved(type)
+            if isinstance(item_type, types._List):
+                item_type = item_type._get_parameter()
+            if _operators(value):
+                value = _stored_condition(item_type, value)
+            else:
+                value = _stored_query(item_type, value)
+        elif operator == "$not":
+            value = _stored_condition(type, value)
+        elif operator in ("$eq", "$ne"):
+            value = _stored_value(type, value)
+        elif operator in ("$in", "$nin", "$all"):
+            value = [_stored_condition(type, item) for item in value]
+        stored[operator] = value
+    return stored
+
+
+def _stored_value(type, value):
+    # Value of `type` compared for equality, whose embedded documents
+    # are given with field names.
+    type = _resolved(type)
+    if type is None or not type._aliased:
+        return value
+    if isinstance(type, types._List):
+        item_type = type._get_parameter()
+        if isinstance(value, list):
+            return [_stored_value(item_type, item) for item in value]
+        # Matches lists containing `value`.
+        return _stored_value(item_type, value)
+    if not isinstance(value, dict):
+        return value
+    if isinstance(type, types._Dict):
+        item_type = type._get_parameters()[1]
+        return {
+            key: _stored_value(item_type, item)
+            for key, item in value.items()
+        }
+    if isinstance(type, StructType):
+        keys = type._keys(types.BSON) or {}
+        return {
+            keys.get(name, name): _stored_value(type._schema.get(name), item)
+            for name, item in value.items()
+        }
+    raise ValueError(f"Cannot translate the fields of {value} "
+                     f"to their stored keys")
+
+
+def _stored_sort(type, sort):
+    # Key, or list of keys or of (key, direction) pairs, given to `sort`.
+    if sort is None or not type._aliased:
+        return sort
+    if isinstance(sort, str):
+        return type.stored_path(sort)
+    if isinstance(sort, dict):
+        return {type.stored_path(key): value for key, value in sort.items()}
+    return [
+        type.stored_path(item) if isinstance(item, str) else
+        (type.stored_path(item[0]), ) + tuple(item[1:]) for item in sort
+    ]
+
+
+def _stored_arguments(type, args, kwargs):
+    # `args` and `kwargs` are those of `find`, with the filter, projection
+    # and sort translated in place if `type` has aliased fields.
+    if not type._aliased:
+        return args
+    args = list(args)
+    for index, name in enumerate(["filter", "projection"]):
+        if index < len(args):
+            args[index] = _stored_query(type, args[index])
+        elif name in kwargs:
+            kwargs[name] = _stored_query(type, kwargs[name])
+    if "sort" in kwargs:
+        kwargs["sort"] = _stored_sort(type, kwargs["sort"])
+    return args
+
+
+def _with_projection(default_type, type, args, kwargs):
+    # `args` and `kwargs` are those of `find`, whose second argument
+    # is the projection.
+    if type is None:
+        return default_type
+    if type._projection is not None and len(args) < 2:
+        kwargs.setdefault("projection", type._projection)
+    return type
+
+
+def _get_path(value, path):
+    for name in path.split("."):
+        value = getattr(value, name)
+    return value
+
+
+def _changes_update(type, document, changes):
+    paths = []
+    for path in sorted(changes.paths):
+        if not any(path.startswith(other + ".") for other in paths):
+            paths.append(path)
+
+    update = {}
+    for path in paths:
+        try:
+            value = _get_path(document, path)
+        except AttributeError:
+            update.setdefault("$unset", {})[type.stored_path(path)] = ""
+        else:
+            value = type._path_type(path).to_bson(value)
+            update.setdefault("$set", {})[type.stored_path(path)] = value
+
+    for path, (items, snapshot) in changes.lists.items():
+        if any(path == other or path.startswith(other + ".")
+               for other in paths):
+            continue
+        list_type = type._path_type(path)
+        path = type.stored_path(path)
+        length = len(snapshot)
+        if len(items) >= length and all(
+                item is old for item, old in zip(items, snapshot)):
+            if len(items) > length:
+                appended = list_type._get_parameter().to_bson_many(
+                    items[length:])
+                update.setdefault("$push", {})[path] = {"$each": appended}
+        else:
+            update.setdefault("$set", {})[path] = list_type.to_bson(items)
+    return update
 
 
 class BasicCursor:
-    def __init__(self, cursor, type):
+    """
+    Iterating decodes documents on the consuming thread. With `prefetch=N`,
+    up to N chunks of `chunk_size` raw documents are fetched ahead
+    from a background thread, so that waiting for the server overlaps
+    with decoding. Decoding itself holds the GIL and is not made faster
+    by more threads.
+    With `trusted=True`, documents are decoded without validation,
+    see `BasicType.from_bson`. The keys given to `sort` are translated
+    with `stored_type`, `type` by default.
+    """
+
+    def __init__(self,
+                 cursor,
+                 type,
+                 prefetch=0,
+                 chunk_size=100,
+                 trusted=False,
+                 stored_type=None):
         self.__cursor = cursor
         self.__type = type
+        self.__prefetch = prefetch
+        self.__chunk_size = chunk_size
+        self.__trusted = trusted
+        self.__stored_type = type if stored_type is None else stored_type
 
     def __getattr__(self, name):
         if name in self.__dict__:
             return self.__dict__[name]
         return getattr(self.__cursor, name)
 
+    def sort(self, key_or_list, direction=None):
+        key_or_list = _stored_sort(self.__stored_type, key_or_list)
+        if direction is None:
+            self.__cursor.sort(key_or_list)
+        else:
+            self.__cursor.sort(key_or_list, direction)
+        return self
+
     def __iter__(self):
-        for item in self.__cursor:
-            yield self.__type.from_bson(item)
+        if not self.__prefetch:
+            from_bson = self.__type.compile(types.BSON,
+                                            self.__trusted).from_jsony
+            for item in self.__cursor:
+                yield from_bson(item)
+            return
+
+        chunks = _prefetch(_chunks(self.__cursor, self.__chunk_size),
+                           self.__prefetch)
+        for chunk in chunks:
+            yield from self.__type.from_bson_many(chunk,
+                                                  trusted=self.__trusted)
 
 
 class BasicCollection:
@@ -59,16 +397,60 @@ class BasicCollection:
         document._id = bson_document["_id"]
         return result
 
-    def insert_many(self, documents, *args, **kwargs):
-        bson_documents = [
-            self.__type.to_bson(document) for document in documents
-        ]
+    def _insert_chunk(self, documents, bson_documents, *args, **kwargs):
         result = self.__collection.insert_many(bson_documents, *args, **kwargs)
         for document, bson_document in zip(documents, bson_documents):
             document._id = bson_document["_id"]
         return result
 
+    def insert_many(self,
+                    documents,
+                    *args,
+                    chunk_size=None,
+                    pipeline=False,
+                    **kwargs):
+        """
+        With `chunk_size`, `documents` can be any iterable and is consumed,
+        encoded and inserted by chunks, so that only one chunk is held
+        in memory (two with `pipeline=True`, where the next chunk is encoded
+        while the previous one is being inserted). The returned result
+        then aggregates all the chunks.
+        """
+        if chunk_size is None:
+            documents = list(documents)
+            return self._insert_chunk(documents,
+                                      self.__type.to_bson_many(documents),
+                                      *args, **kwargs)
+
+        inserted_ids = []
+        acknowledged = True
+
+        def collect(result):
+            nonlocal acknowledged
+            acknowledged = acknowledged and result.acknowledged
+            inserted_ids.extend(result.inserted_ids)
+
+        with ThreadPoolExecutor(1) as executor:
+            pending = None
+            for chunk in _chunks(documents, chunk_size):
+                bson_chunk = self.__type.to_bson_many(chunk)
+                if pending is not None:
+                    collect(pending.result())
+                if pipeline:
+                    pending = executor.submit(self._insert_chunk, chunk,
+                                              bson_chunk, *args, **kwargs)
+                else:
+                    collect(
+                        self._insert_chunk(chunk, bson_chunk, *args,
+                                           **kwargs))
+                del chunk, bson_chunk
+            if pending is not None:
+                collect(pending.result())
+        return _insert_many_result(inserted_ids, acknowledged)
+
     def replace_one(self, filter, replacement, *args, **kwargs):
+        if self.__type._aliased:
+            filter = _stored_query(self.__type, filter)
         return self.__collection.replace_one(filter,
                                              self.__type.to_bson(replacement),
                                              *args, **kwargs)
@@ -78,29 +460,267 @@ class BasicCollection:
             "_id": document._id
         }, document, *args, **kwargs)
 
+    def save_changes(self, document, *args, **kwargs):
+        """
+        Update the stored `document` with only the changes recorded since
+        `document._track_changes()` using `$set`, `$unset` and `$push`,
+        then start recording again. Return None if there was nothing to save.
+        """
+        changes = document._changes
+        if changes is None:
+            raise ValueError("Changes are not tracked on this document, "
+                             "call `document._track_changes()` first")
+        update = _changes_update(self.__type, document, changes)
+        result = None
+        if update:
+            result = self.__collection.update_one({
+                "_id": document._id
+            }, update, *args, **kwargs)
+        changes.clear()
+        document._track_changes(changes)
+        return result
+
     def with_options(self, *args, **kwargs):
         collection = self.__collection.with_options(*args, **kwargs)
         return BasicCollection(collection, self.__type)
 
-    def find(self, *args, **kwargs):
+    def find(self,
+             *args,
+             type=None,
+             prefetch=0,
+             trusted=False,
+             **kwargs):
+        """
+        Documents are decoded with `type` if given, typically a type
+        obtained from `StructType.project`, whose projection is then
+        sent to the server unless one is already provided.
+        Fields in the filter, projection and sort are translated to the keys
+        they are stored under, see `StructType.stored_path`, which methods
+        passed through to the collection, such as `update_many`, do not.
+        """
+        args = _stored_arguments(self.__type, args, kwargs)
+        type = _with_projection(self.__type, type, args, kwargs)
         return BasicCursor(
-            self.__collection.find(*args, **kwargs), self.__type)
+            self.__collection.find(*args, **kwargs),
+            type,
+            prefetch=prefetch,
+            trusted=trusted,
+            stored_type=self.__type)
 
-    def find_one(self, *args, **kwargs):
+    def find_one(self, *args, type=None, trusted=False, **kwargs):
+        args = _stored_arguments(self.__type, args, kwargs)
+        type = _with_projection(self.__type, type, args, kwargs)
         result = self.__collection.find_one(*args, **kwargs)
         if result is not None:
-            result = self.__type.from_bson(result)
+            result = type.from_bson(result, trusted=trusted)
         return result
 
-    def refresh(self, documents, projection=None):
+    def refresh(self, documents, projection=None, chunk_size=1000, workers=1):
+        """
+        Reload `documents` from the collection, querying their ids by chunks
+        of `chunk_size`, using up to `workers` concurrent queries.
+        Raise `MissingDocuments` if some were not found, after the others
+        have been refreshed.
+        """
         ids_to_documents = {document._id: document for document in documents}
-        query = {"_id": {"$in": list(ids_to_documents.keys())}}
-        results = self.__collection.find(query, projection=projection)
-        for result in results:
-            document = ids_to_documents.pop(result["_id"])
-            for key, value in result.items():
-                type = self.__type.field(key)
-                setattr(document, key, type.from_bson(value))
-        assert not ids_to_documents
+        decoders = self.__type._field_decoders(types.BSON)
+        if self.__type._aliased:
+            projection = _stored_query(self.__type, projection)
+
+        def fetch(ids):
+            query = {"_id": {"$in": ids}}
+            return list(self.__collection.find(query, projection=projection))
+
+        chunks = _chunks(list(ids_to_documents), chunk_size)
+        if workers > 1:
+            fetched = _map_ordered(fetch, chunks, workers)
+        else:
+            fetched = map(fetch, chunks)
+        for results in fetched:
+            _refresh_documents(ids_to_documents, results, decoders)
+        if ids_to_documents:
+            raise MissingDocuments(list(ids_to_documents))
+
+        return documents
+
+
+class AsyncBasicCursor:
+    """
+    Wraps a motor-style async cursor. Documents are decoded by batches
+    of `batch_size`, full batches being decoded on `executor`
+    (the default thread pool if None) to keep the event loop responsive.
+    The keys given to `sort` are translated with `stored_type`, `type`
+    by default.
+    """
+
+    def __init__(self,
+                 cursor,
+                 type,
+                 batch_size=256,
+                 executor=None,
+                 trusted=False,
+                 stored_type=None):
+        self.__cursor = cursor
+        self.__type = type
+        self.__batch_size = batch_size
+        self.__executor = executor
+        self.__trusted = trusted
+        self.__stored_type = type if stored_type is None else stored_type
+
+    def __getattr__(self, name):
+        if name in self.__dict__:
+            return self.__dict__[name]
+        return getattr(self.__cursor, name)
+
+    def sort(self, key_or_list, direction=None):
+        key_or_list = _stored_sort(self.__stored_type, key_or_list)
+        if direction is None:
+            self.__cursor.sort(key_or_list)
+        else:
+            self.__cursor.sort(key_or_list, direction)
+        return self
+
+    async def _decode(self, batch):
+        if len(batch) < self.__batch_size:
+            return self.__type.from_bson_many(batch, self.__trusted)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.__executor, self.__type.from_bson_many, batch,
+            self.__trusted)
+
+    async def __aiter__(self):
+        batch = []
+        async for item in self.__cursor:
+            batch.append(item)
+            if len(batch) >= self.__batch_size:
+                for value in await self._decode(batch):
+                    yield value
+                batch = []
+        for value in await self._decode(batch):
+            yield value
+
+    async def to_list(self, length=None):
+        return await self._decode(await self.__cursor.to_list(length))
+
+
+class AsyncBasicCollection:
+    """
+    Async counterpart of `BasicCollection` for motor-style collections,
+    whose methods other than `find` and `with_options` are coroutines.
+    """
+
+    def __init__(self, collection, type, batch_size=256, executor=None):
+        self.__collection = collection
+        self.__type = type
+        self.__batch_size = batch_size
+        self.__executor = executor
+
+    def __getattr__(self, name):
+        if name in self.__dict__:
+            return self.__dict__[name]
+        return getattr(self.__collection, name)
+
+    async def insert_one(self, document, *args, **kwargs):
+        bson_document = self.__type.to_bson(document)
+        result = await self.__collection.insert_one(bson_document, *args,
+                                                    **kwargs)
+        document._id = bson_document["_id"]
+        return result
+
+    async def _insert_chunk(self, documents, *args, **kwargs):
+        if len(documents) < self.__batch_size:
+            bson_documents = self.__type.to_bson_many(documents)
+        else:
+            loop = asyncio.get_running_loop()
+            bson_documents = await loop.run_in_executor(
+                self.__executor, self.__type.to_bson_many, documents)
+        result = await self.__collection.insert_many(bson_documents, *args,
+                                                     **kwargs)
+        for document, bson_document in zip(documents, bson_documents):
+            document._id = bson_document["_id"]
+        return result
+
+    async def insert_many(self, documents, *args, chunk_size=None, **kwargs):
+        if chunk_size is None:
+            return await self._insert_chunk(list(documents), *args, **kwargs)
+        inserted_ids = []
+        acknowledged = True
+        for chunk in _chunks(documents, chunk_size):
+            result = await self._insert_chunk(chunk, *args, **kwargs)
+            acknowledged = acknowledged and result.acknowledged
+            inserted_ids.extend(result.inserted_ids)
+        return _insert_many_result(inserted_ids, acknowledged)
+
+    async def replace_one(self, filter, replacement, *args, **kwargs):
+        if self.__type._aliased:
+            filter = _stored_query(self.__type, filter)
+        return await self.__collection.replace_one(
+            filter, self.__type.to_bson(replacement), *args, **kwargs)
+
+    async def replace_document(self, document, *args, **kwargs):
+        return await self.replace_one({
+            "_id": document._id
+        }, document, *args, **kwargs)
+
+    async def save_changes(self, document, *args, **kwargs):
+        changes = document._changes
+        if changes is None:
+            raise ValueError("Changes are not tracked on this document, "
+                             "call `document._track_changes()` first")
+        update = _changes_update(self.__type, document, changes)
+        result = None
+        if update:
+            result = await self.__collection.update_one({
+                "_id": document._id
+            }, update, *args, **kwargs)
+        changes.clear()
+        document._track_changes(changes)
+        return result
+
+    def with_options(self, *args, **kwargs):
+        collection = self.__collection.with_options(*args, **kwargs)
+        return AsyncBasicCollection(collection, self.__type,
+                                    self.__batch_size, self.__executor)
+
+    def find(self, *args, type=None, trusted=False, **kwargs):
+        args = _stored_arguments(self.__type, args, kwargs)
+        type = _with_projection(self.__type, type, args, kwargs)
+        return AsyncBasicCursor(
+            self.__collection.find(*args, **kwargs),
+            type,
+            self.__batch_size,
+            self.__executor,
+            trusted,
+            stored_type=self.__type)
+
+    async def find_one(self, *args, type=None, trusted=False, **kwargs):
+        args = _stored_arguments(self.__type, args, kwargs)
+        type = _with_projection(self.__type, type, args, kwargs)
+        result = await self.__collection.find_one(*args, **kwargs)
+        if result is not None:
+            result = type.from_bson(result, trusted=trusted)
+        return result
+
+    async def refresh(self,
+                      documents,
+                      projection=None,
+                      chunk_size=1000,
+                      workers=1):
+        ids_to_documents = {document._id: document for document in documents}
+        decoders = self.__type._field_decoders(types.BSON)
+        if self.__type._aliased:
+            projection = _stored_query(self.__type, projection)
+
+        async def fetch(ids):
+            query = {"_id": {"$in": ids}}
+            cursor = self.__collection.find(query, projection=projection)
+            return await cursor.to_list(None)
+
+        chunks = _chunks(list(ids_to_documents), chunk_size)
+        for group in _chunks(chunks, workers):
+            for results in await asyncio.gather(*map(fetch, group)):
+                _refresh_documents(ids_to_documents, results, decoders)
+        if ids_to_documents:
+            raise MissingDocuments(list(ids_to_documents))
 
         return documents
@@ -0,0 +1,244 @@
+import base64
+import zlib
+
+import numpy as np
+from numpy.lib import format as npy
+
+from . import binary, inspection
+from .types import BasicType, validate_class, BSON, JSON
+
+
+def _order(value):
+    # Memory order in which the buffer of `value` is written, Fortran
+    # order only for arrays which are not also C contiguous.
+    if value.flags.f_contiguous and not value.flags.c_contiguous:
+        return "F"
+    return "C"
+
+
+def _dtype_jsony(dtype):
+    # Description of `dtype` as a string, or as a list of fields
+    # for structured dtypes.
+    if dtype.hasobject:
+        raise TypeError(f"Unsupported dtype {dtype}")
+    if dtype.fields is None:
+        return dtype.str
+    return npy.dtype_to_descr(dtype)
+
+
+def _dtype_fields(jsony):
+    # Fields of a structured dtype description, whose tuples
+    # are lists once decoded.
+    if isinstance(jsony, str):
+        return jsony
+    return [
+        tuple([field[0], _dtype_fields(field[1])] +
+              [tuple(shape) for shape in field[2:]])
+        for field in validate_class(jsony, list)
+    ]
+
+
+def _dtype(jsony):
+    return npy.descr_to_dtype(_dtype_fields(jsony))
+
+
+def _encode(value, target, compress=False):
+    # Document with the dtype, shape and memory order of `value` and its
+    # raw buffer, base64 encoded and optionally zlib compressed in JSON.
+    order = _order(value)
+    content = value.tobytes(order)
+    jsony = {"shape": list(value.shape), "dtype": _dtype_jsony(value.dtype)}
+    if target is JSON:
+        if compress:
+            content = zlib.compress(content)
+            jsony["compression"] = "zlib"
+        jsony["content"] = base64.b64encode(content).decode('ascii')
+    elif target is BSON:
+        jsony["content"] = content
+    else:
+        raise ValueError(f"Unsupported target {target}")
+    if order == "F":
+        jsony["order"] = "F"
+    return jsony
+
+
+def _decode(jsony, source):
+    # Buffer, dtype, shape and order of a document written by `_encode`.
+    validate_class(jsony, dict)
+    shape = validate_class(jsony['shape'], list)
+    if source is JSON:
+        content = base64.b64decode(validate_class(jsony['content'], str))
+        compression = jsony.get('compression')
+        if compression == "zlib":
+            content = zlib.decompress(content)
+        elif compression is not None:
+            raise ValueError(f"Unsupported compression {compression}")
+    elif source is BSON:
+        content = validate_class(jsony['content'], bytes)
+    else:
+        raise ValueError(f"Unsupported source {source}")
+    order = jsony.get('order', "C")
+    if order not in ("C", "F"):
+        raise ValueError(f"Unsupported order {order}")
+    return content, _dtype(jsony['dtype']), shape, order
+
+
+def _array(content, dtype, shape, order, writable):
+    # Array sharing the memory of `content`, unless it has to be converted
+    # to the native byte order or `writable` asks for a copy.
+    value = np.frombuffer(content, dtype=dtype).reshape(shape, order=order)
+    if not dtype.isnative:
+        value = value.astype(dtype.newbyteorder("="))
+    elif writable:
+        value = value.copy(order="A")
+    return value
+
+
+def _write(value, out):
+    # Binary form of `_encode`: dtype, order, shape and raw buffer.
+    order = _order(value)
+    if order == "C":
+        value = np.require(value, requirements="C")
+    binary.write_any(_dtype_jsony(value.dtype), out)
+    out.append(order == "F")
+    binary.write_uint(value.ndim, out)
+    for size in value.shape:
+        binary.write_uint(size, out)
+    binary.write_bytes(value.reshape(-1, order=order).view(np.uint8).data, out)
+
+
+def _read(data, pos):
+    # Same as `_decode` for `_write`, the buffer shares the memory of `data`.
+    dtype, pos = binary.read_any(data, pos)
+    order = "F" if data[pos] else "C"
+    ndim, pos = binary.read_uint(data, pos + 1)
+    shape = []
+    for _ in range(ndim):
+        size, pos = binary.read_uint(data, pos)
+        shape.append(size)
+    size, pos = binary.read_uint(data, pos)
+    end = pos + size
+    return (memoryview(data)[pos:end], _dtype(dtype), shape, order), end
+
+
+class _NDArray(BasicType):
+    """
+    Numpy array of any dtype. `NDArray[dtype]` and `NDArray[dtype, shape]`
+    only accept arrays of this dtype and shape, where `shape` is a tuple
+    whose `None` items match any size, and `dtype` may be None.
+    """
+
+    def __init__(self,
+                 *,
+                 klass=np.ndarray,
+                 dtype=None,
+                 shape=None,
+                 writable=False,
+                 compress=False,
+                 **kwargs):
+        super().__init__(klass=klass, **kwargs)
+        self._dtype = dtype
+        self._shape = shape
+        self._writable = writable
+        self._compress = compress
+
+    def __getitem__(self, parameters):
+        if not isinstance(parameters, tuple):
+            parameters = (parameters, )
+        if len(parameters) not in [1, 2]:
+            raise ValueError("NDArray takes one or two template parameters")
+        if self._dtype is not None or self._shape is not None:
+            raise ValueError("Cannot specialize already specialized type")
+        dtype = parameters[0]
+        if dtype is not None:
+            dtype = np.dtype(dtype)
+        shape = None
+        if len(parameters) == 2:
+            shape = tuple(parameters[1])
+            for size in shape:
+                if size is not None:
+                    validate_class(size, int)
+        return self._change(dtype=dtype, shape=shape)
+
+    @property
+    def name(self):
+        if self._dtype is None and self._shape is None:
+            return "NDArray"
+        parameters = [str(self._dtype)]
+        if self._shape is not None:
+            parameters.append(str(self._shape))
+        return "NDArray[{}]".format(", ".join(parameters))
+
+    def __eq__(self, other):
+        if not super().__eq__(other):
+            return False
+        return ((self._dtype, self._shape, self._writable, self._compress) ==
+                (other._dtype, other._shape, other._writable, other._compress))
+
+    def _equal_default(self, default):
+        mine = self._default
+        if not (isinstance(mine, np.ndarray)
+                or isinstance(default, np.ndarray)):
+            return super()._equal_default(default)
+        return (isinstance(mine, np.ndarray)
+                and isinstance(default, np.ndarray)
+                and mine.dtype == default.dtype
+                and np.array_equal(mine, default))
+
+    @property
+    def writable(self):
+        # By default, arrays decoded from BSON share the read-only memory
+        # of the document, this copies them instead.
+        return self._change(writable=True)
+
+    @property
+    def compressed(self):
+        # zlib compress the buffer of arrays exported to JSON.
+        return self._change(compress=True)
+
+    def _check(self, dtype, shape):
+        if self._dtype is not None and dtype != self._dtype:
+            raise TypeError(f"Expected array of dtype {self._dtype} "
+                            f"but got {dtype}")
+        expected = self._shape
+        if expected is None:
+            return
+        if len(shape) != len(expected) or any(
+                size is not None and size != actual
+                for size, actual in zip(expected, shape)):
+            raise ValueError(f"Expected array of shape {expected} "
+                             f"but got {tuple(shape)}")
+
+    def _to_jsony(self, value, target):
+        validate_class(value, self.klass)
+        self._check(value.dtype, value.shape)
+        return _encode(value, target, self._compress)
+
+    def _from_jsony(self, jsony, source):
+        # Nested lists, for instance written by hand, take the dtype
+        # of the type if any.
+        if isinstance(jsony, list):
+            value = np.array(jsony, dtype=self._dtype)
+            self._check(value.dtype, value.shape)
+            return value
+        return self._from_buffer(*_decode(jsony, source))
+
+    def _from_buffer(self, content, dtype, shape, order):
+        self._check(dtype.newbyteorder("="), shape)
+        return _array(content, dtype, shape, order, self._writable)
+
+    def _binary_codec(self):
+        def write(value, out):
+            validate_class(value, self.klass)
+            self._check(value.dtype, value.shape)
+            _write(value, out)
+
+        def read(data, pos):
+            parts, pos = _read(data, pos)
+            return self._from_buffer(*parts), pos
+
+        return write, read
+
+
+NDArray = _NDArray()
+inspection.register_type(NDArray)
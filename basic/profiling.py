@@ -0,0 +1,155 @@
+# Opt-in profiling of the conversions of basic types.
+#
+#   with basic.profiling.profile() as profiler:
+#       Document.from_bson(bson)
+#   print(profiler.table())
+#
+# While a profiler is active, `compile` returns the generic, uncompiled
+# conversions, in which `to_jsony`, `from_jsony` and `apply` report to it,
+# keyed by operation, type name and field path. Times are thus those of the
+# generic code path, useful to compare types and fields with each other.
+# When no profiler is active, the hooks cost one global check.
+from collections import namedtuple
+import contextlib
+import threading
+import time
+
+# Active `Profiler`, checked by the hooks.
+profiler = None
+
+Row = namedtuple(
+    "Row", ["operation", "type", "path", "count", "total", "self", "bytes"])
+
+
+class _Stats:
+    __slots__ = ["count", "total", "self", "bytes"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.self = 0.
+        self.bytes = 0
+
+
+def _size(value):
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 0
+
+
+class Profiler:
+    """
+    Aggregates, for each operation, type name and field path, the number
+    of calls, their cumulative time, their own time excluding nested
+    conversions, and the length of the str and bytes values converted.
+    List items and dict values are counted under the path of their
+    container.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _state(self):
+        local = self._local
+        try:
+            return local.path, local.children
+        except AttributeError:
+            local.path = []
+            local.children = []
+            return local.path, local.children
+
+    def call(self, operation, type_, function, value, *args):
+        path, children = self._state()
+        children.append(0.)
+        begin = time.perf_counter()
+        try:
+            result = function(value, *args)
+        finally:
+            elapsed = time.perf_counter() - begin
+            nested = children.pop()
+            if children:
+                children[-1] += elapsed
+        size = _size(value if operation == "from_jsony" else result)
+        key = (operation, type_.name, ".".join(path))
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _Stats()
+            stats.count += 1
+            stats.total += elapsed
+            stats.self += elapsed - nested
+            stats.bytes += size
+        return result
+
+    def field(self, name, function, *args):
+        # Call `function` with `name` appended to the current field path.
+        path, _ = self._state()
+        path.append(name)
+        try:
+            return function(*args)
+        finally:
+            path.pop()
+
+    def path(self):
+        return tuple(self._state()[0])
+
+    def at(self, path, function, *args):
+        # Call `function` with the field path set to `path`, for conversions
+        # resumed outside of their parent, such as lazily decoded fields.
+        current, _ = self._state()
+        saved = current[:]
+        current[:] = path
+        try:
+            return function(*args)
+        finally:
+            current[:] = saved
+
+    def rows(self):
+        """
+        Return a list of `Row`, slowest own time first.
+        """
+        with self._lock:
+            rows = [
+                Row(*key, stats.count, stats.total, stats.self, stats.bytes)
+                for key, stats in self._stats.items()
+            ]
+        rows.sort(key=lambda row: row.self, reverse=True)
+        return rows
+
+    def table(self, limit=None):
+        rows = self.rows()[:limit]
+        header = ("operation", "type", "path", "count", "total (ms)",
+                  "self (ms)", "bytes")
+        lines = [header] + [(row.operation, row.type, row.path or "-",
+                             str(row.count), f"{row.total * 1000:.3f}",
+                             f"{row.self * 1000:.3f}", str(row.bytes))
+                            for row in rows]
+        widths = [max(len(line[i]) for line in lines) for i in range(7)]
+        return "\n".join("  ".join(
+            cell.ljust(width) if index < 3 else cell.rjust(width)
+            for index, (cell, width) in enumerate(zip(line, widths)))
+                         for line in lines)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+@contextlib.contextmanager
+def profile(callback=None):
+    """
+    Profile the conversions done in the block, from all threads.
+    On exit, `callback` is called with the list of `Row` if given.
+    """
+    global profiler
+    previous = profiler
+    profiler = Profiler()
+    try:
+        yield profiler
+    finally:
+        current = profiler
+        profiler = previous
+        if callback is not None:
+            callback(current.rows())
@@ -1,10 +1,43 @@
+import datetime
+import enum
+import keyword
+import pathlib
 import pydoc
 
-from . import types
+from . import binary, profiling, types
 from .utils import top_calling_module_name
 
+_NOVALUE = object()
+
+
+class Changes:
+    """
+    Paths of the fields set or deleted on a struct and the structs nested
+    in it, since `Struct._track_changes` was called. `lists` holds lists
+    with a shallow copy of their items at that time to detect their changes.
+    """
+
+    def __init__(self):
+        self.paths = set()
+        self.lists = {}
+
+    def clear(self):
+        self.paths.clear()
+        self.lists.clear()
+
 
 class Struct:
+    # Undecoded fields and their source for structs decoded with `lazy=True`.
+    _raw = None
+    _source = None
+    # Field path of a struct decoded lazily while profiling.
+    _profile_path = ()
+    # See `_track_changes`. `_changes` records the changes of the struct as
+    # a document, `_trackers` holds the `Changes` of each document
+    # containing it, with the path of the struct in that document.
+    _changes = None
+    _trackers = ()
+
     def __init__(self, **kwargs):
         remaining = set(self._schema.keys())
         self.__dict__["_fields"] = {}
@@ -12,7 +45,7 @@ class Struct:
             if name not in remaining:
                 raise NameError("Invalid argument {}".format(name))
             remaining.remove(name)
-            self._fields[name] = value
+            self._store(name, value)
 
         for name in remaining:
             type = self._schema[name]
@@ -21,13 +54,13 @@ class Struct:
             elif type._default is types.MISSING:
                 continue
             else:
-                self._fields[name] = type.default_value()
+                self._store(name, type.default_value())
 
     def __repr__(self):
         return "{}({})".format(
             self.__class__.__name__,
             ", ".join("{}={!r}".format(name, value)
-                      for name, value in self._fields.items()))
+                      for name, value in self._load().items()))
 
     def __hash__(self):
         return hash(self._cmp_repr)
@@ -43,15 +76,110 @@ class Struct:
 
     @property
     def _cmp_repr(self):
-        return tuple([(name, self._fields.get(name, types.MISSING))
+        fields = self._load()
+        return tuple([(name, fields.get(name, types.MISSING))
                       for name in self._schema.keys()])
 
+    def _store(self, name, value):
+        self._fields[name] = value
+
+    def _load_field(self, name):
+        raw = self._raw
+        from_jsony = self._schema[name].from_jsony
+        profiler = profiling.profiler
+        if profiler is None:
+            value = from_jsony(raw[name], self._source, lazy=True)
+        else:
+            value = profiler.at(self._profile_path + (name, ), from_jsony,
+                                raw[name], self._source, True)
+        self._store(name, value)
+        del raw[name]
+        for changes, prefix in self._trackers:
+            _watch(changes, prefix + name, value)
+        return value
+
+    def _track_changes(self, changes=None, prefix=""):
+        """
+        Start recording in `Changes` the fields set or deleted
+        on this struct and on the structs nested in it,
+        as well as changes to its lists. Elements of lists are compared by
+        identity, so those modified in place are not detected.
+        Structs nested in several tracked documents record their changes
+        in each of them, and stop when they are replaced or deleted.
+        """
+        if changes is None:
+            changes = Changes()
+        trackers = [(other, path) for other, path in self._trackers
+                    if other is not changes]
+        trackers.append((changes, prefix))
+        self.__dict__["_trackers"] = tuple(trackers)
+        if not prefix:
+            self.__dict__["_changes"] = changes
+        for name, value in self._fields.items():
+            _watch(changes, prefix + name, value)
+        return changes
+
+    def _untrack(self, changes):
+        # Stop recording in `changes`, for a struct removed from a document.
+        trackers = tuple((other, path) for other, path in self._trackers
+                         if other is not changes)
+        if len(trackers) == len(self._trackers):
+            return
+        self.__dict__["_trackers"] = trackers
+        for value in self._fields.values():
+            if isinstance(value, Struct):
+                value._untrack(changes)
+
+    def _changed(self, name, old, value=_NOVALUE):
+        # `old` is the previous value, None if it was not set or decoded.
+        for changes, prefix in self._trackers:
+            changes.paths.add(prefix + name)
+            if isinstance(old, Struct):
+                old._untrack(changes)
+            if value is not _NOVALUE:
+                _watch(changes, prefix + name, value)
+
+    def _refresh_field(self, name, value):
+        """
+        Set the field `name` to `value` as read from the database. The field
+        is not recorded as changed in the document this struct was tracked
+        as, but its new value is tracked from now on.
+        """
+        if not self._trackers:
+            setattr(self, name, value)
+            return
+        old = self._fields.get(name)
+        self._store(name, value)
+        if self._raw:
+            self._raw.pop(name, None)
+        for changes, prefix in self._trackers:
+            if prefix:
+                changes.paths.add(prefix + name)
+            else:
+                _forget(changes, name)
+            if isinstance(old, Struct):
+                old._untrack(changes)
+            _watch(changes, prefix + name, value)
+
+    def _load(self):
+        """
+        Decode all the fields not decoded yet and return `_fields`.
+        """
+        raw = self._raw
+        if raw:
+            for name in list(raw):
+                self._load_field(name)
+        return self._fields
+
     def __getattr__(self, name):
         schema = self.__getattribute__("_schema")
         if name in schema:
             try:
                 return self._fields[name]
             except KeyError:
+                raw = self._raw
+                if raw is not None and name in raw:
+                    return self._load_field(name)
                 raise AttributeError(f"Field {name} not set")
         elif name.startswith('_'):
             return self.__getattribute__(name)
@@ -60,7 +188,13 @@ class Struct:
 
     def __setattr__(self, name, value):
         if name in self._schema:
+            if self._trackers:
+                old = self._fields.get(name)
             self._fields[name] = value
+            if self._raw:
+                self._raw.pop(name, None)
+            if self._trackers:
+                self._changed(name, old, value)
         elif name.startswith('_'):
             self.__dict__[name] = value
         else:
@@ -68,10 +202,16 @@ class Struct:
 
     def __delattr__(self, name):
         if name in self._schema:
-            try:
-                del self._fields[name]
-            except KeyError:
-                raise AttributeError(f"Field {name} not set")
+            old = None
+            if self._raw and name in self._raw:
+                del self._raw[name]
+            else:
+                try:
+                    old = self._fields.pop(name)
+                except KeyError:
+                    raise AttributeError(f"Field {name} not set")
+            if self._trackers:
+                self._changed(name, old)
         elif name.startswith('_'):
             try:
                 del self.__dict__[name]
@@ -88,20 +228,505 @@ class Struct:
     @property
     def _bson(self):
         schema = self.__getattribute__("_schema")
-        return _to_jsony(self, schema, target=types.BSON)
+        return _to_jsony(self,
+                         schema,
+                         target=types.BSON,
+                         keys=_stored_keys(schema, types.BSON))
+
+
+def _watch(changes, path, value):
+    # Record in `changes` the changes to `value`, stored at `path`.
+    if isinstance(value, Struct):
+        value._track_changes(changes, path + ".")
+    elif isinstance(value, list):
+        changes.lists[path] = (value, list(value))
+
+
+def _forget(changes, path):
+    # Drop the changes recorded at `path` or below.
+    prefix = path + "."
+    changes.paths.difference_update([
+        other for other in changes.paths
+        if other == path or other.startswith(prefix)
+    ])
+    for other in list(changes.lists):
+        if other == path or other.startswith(prefix):
+            del changes.lists[other]
+
+
+class SlotStruct(Struct):
+    """
+    Struct storing each field in its own slot, see `struct(__slots=True)`.
+    `_fields` is then a snapshot of the fields currently set.
+    """
+
+    @property
+    def _fields(self):
+        fields = {}
+        for name, slot in self._slots.items():
+            try:
+                fields[name] = slot.__get__(self)
+            except AttributeError:
+                pass
+        return fields
+
+    def _store(self, name, value):
+        self._slots[name].__set__(self, value)
+
+    def __getattr__(self, name):
+        # Only called for unset slots and unknown attributes.
+        if name in self._schema:
+            raw = self._raw
+            if raw is not None and name in raw:
+                return self._load_field(name)
+            raise AttributeError(f"Field {name} not set")
+        elif name.startswith('_'):
+            return self.__getattribute__(name)
+        else:
+            raise AttributeError(f"{self} has no attribute {name}")
+
+    def __setattr__(self, name, value):
+        if name in self._schema:
+            if self._trackers:
+                old = self._fields.get(name)
+            object.__setattr__(self, name, value)
+            if self._raw:
+                self._raw.pop(name, None)
+            if self._trackers:
+                self._changed(name, old, value)
+        elif name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            raise AttributeError(f"{self} has no attribute {name}")
+
+    def __delattr__(self, name):
+        old = None
+        if self._raw and name in self._raw:
+            del self._raw[name]
+        else:
+            if self._trackers and name in self._schema:
+                old = self._fields.get(name)
+            try:
+                object.__delattr__(self, name)
+            except AttributeError:
+                if name in self._schema:
+                    raise AttributeError(f"Field {name} not set")
+                raise AttributeError(f"{self} has no attribute {name}")
+        if self._trackers and name in self._schema:
+            self._changed(name, old)
+
+
+class FrozenStruct(Struct):
+    """
+    Struct whose fields cannot be set or deleted, see `struct(__frozen=True)`.
+    Its hash is computed once if no field holds a mutable value, use
+    `evolve` to get modified copies.
+    """
+
+    def __setattr__(self, name, value):
+        if name in self._schema or not name.startswith('_'):
+            raise AttributeError(
+                f"Cannot set {name}, {self.__class__.__name__} is frozen")
+        super(FrozenStruct, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if name in self._schema or not name.startswith('_'):
+            raise AttributeError(
+                f"Cannot delete {name}, {self.__class__.__name__} is frozen")
+        super(FrozenStruct, self).__delattr__(name)
+
+    def __hash__(self):
+        try:
+            return self.__dict__["_hash"]
+        except KeyError:
+            pass
+        hash_ = hash(self._cmp_repr)
+        # Fields such as mutable structs may change, and with them the hash.
+        if all(map(_immutable, self._load().values())):
+            self.__dict__["_hash"] = hash_
+        return hash_
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, FrozenStruct):
+            # Only cached hashes are cheap, and they cannot go stale.
+            hash_ = self.__dict__.get("_hash")
+            other_hash = other.__dict__.get("_hash")
+            if (hash_ is not None and other_hash is not None
+                    and hash_ != other_hash):
+                return False
+        return super(FrozenStruct, self).__eq__(other)
+
+    def __reduce__(self):
+        # Rebuilt from its fields, as the cached hash depends on the process.
+        return _new_struct, (self.__class__, self._load())
+
+
+# Classes of field values which cannot be modified.
+_IMMUTABLE_CLASSES = (bool, int, float, complex, str, bytes, type(None),
+                      datetime.date, datetime.time, datetime.timedelta,
+                      enum.Enum, pathlib.PurePath)
+
+
+def _immutable(value):
+    if isinstance(value, _IMMUTABLE_CLASSES):
+        return True
+    elif isinstance(value, (tuple, frozenset)):
+        return all(map(_immutable, value))
+    elif isinstance(value, FrozenStruct):
+        hash(value)
+        return "_hash" in value.__dict__
+    return False
+
+
+def _new_struct(klass, fields):
+    return klass(**fields)
+
+
+def evolve(__struct, **changes):
+    """
+    Return a copy of a struct with the fields in `changes` set.
+    The other fields are shared with the original rather than copied,
+    and stay undecoded if it was decoded with `lazy=True`.
+    """
+    schema = __struct._schema
+    for name in changes:
+        if name not in schema:
+            raise NameError("Invalid argument {}".format(name))
+    klass = __struct.__class__
+    value = klass.__new__(klass)
+    if "_schema" in __struct.__dict__:
+        value.__dict__["_schema"] = schema
+    if not isinstance(value, SlotStruct):
+        value.__dict__["_fields"] = {}
+    fields = __struct._fields
+    for name in schema:
+        if name in changes:
+            value._store(name, changes[name])
+        elif name in fields:
+            value._store(name, fields[name])
+    raw = __struct._raw
+    if raw:
+        value.__dict__["_raw"] = {
+            name: item
+            for name, item in raw.items() if name not in changes
+        }
+        value.__dict__["_source"] = __struct._source
+    return value
+
+
+def _invalid_argument(kwargs):
+    raise NameError("Invalid argument {}".format(next(iter(kwargs))))
 
 
-def _to_jsony(struct, schema, target):
+def _argument_names(schema):
+    # Whether all field names can be arguments of a generated function.
+    return all(
+        name.isidentifier() and not keyword.iskeyword(name)
+        for name in schema)
+
+
+def _make_init(klass, schema):
+    """
+    Generate an `__init__` for `klass` knowing up front which fields
+    are required, defaulted or left missing.
+    """
+    slots = getattr(klass, "_slots", None)
+
+    def free(name):
+        # Internal name of the generated code, which no argument shadows.
+        while name in schema:
+            name += "_"
+        return name
+
+    self, fields, extra = free("__self"), free("__fields"), free("__extra")
+    novalue, invalid = free("__NOVALUE"), free("__invalid_argument")
+    namespace = {novalue: _NOVALUE, invalid: _invalid_argument}
+    arguments = []
+    body = []
+    if slots is None:
+        body.append(f"{fields} = {{}}")
+    for index, (name, type_) in enumerate(schema.items()):
+        if slots is None:
+            store = f"{fields}[{name!r}] = {name}"
+        else:
+            setter = free(f"__set_{index}")
+            store = f"{setter}({self}, {name})"
+            namespace[setter] = slots[name].__set__
+        default = type_._default
+        if default is types.REQUIRED:
+            arguments.append(name)
+            body.append(store)
+        elif default is types.MISSING:
+            arguments.append(f"{name}={novalue}")
+            body.append(f"if {name} is not {novalue}:")
+            body.append("    " + store)
+        elif isinstance(default, types.DefaultValue):
+            arguments.append(f"{name}={novalue}")
+            factory = free(f"__default_{index}")
+            namespace[factory] = type_.default_value
+            body.append(f"if {name} is {novalue}:")
+            body.append(f"    {name} = {factory}()")
+            body.append(store)
+        else:
+            value = free(f"__default_{index}")
+            arguments.append(f"{name}={value}")
+            namespace[value] = default
+            body.append(store)
+    if slots is None:
+        body.append(f"{self}.__dict__['_fields'] = {fields}")
+    arguments = ", ".join(["*"] * bool(arguments) + arguments +
+                          [f"**{extra}"])
+    lines = [f"def __init__({self}, {arguments}):"]
+    lines.append(f"    if {extra}:")
+    lines.append(f"        {invalid}({extra})")
+    lines.extend("    " + line for line in body)
+    exec("\n".join(lines), namespace)
+    init = namespace["__init__"]
+    init.__qualname__ = f"{klass.__qualname__}.__init__"
+    init._generated = True
+    return init
+
+
+def _unknown_field(jsony, schema):
+    for name in jsony:
+        if name not in schema:
+            raise KeyError(name)
+
+
+def _stored_keys(schema, target):
+    """
+    Return the key under which each field is stored in `target` documents,
+    or None if all fields are stored under their name. Aliases only apply
+    to BSON, see `BasicType.alias`.
+    """
+    if target is not types.BSON:
+        return None
+    keys = {
+        name: name if type_._alias is None else type_._alias
+        for name, type_ in schema.items()
+    }
+    if all(name == key for name, key in keys.items()):
+        return None
+    if len(set(keys.values())) != len(keys):
+        raise ValueError(f"Fields stored under the same key: {keys}")
+    return keys
+
+
+def _convert_lines(convert, index, dest, namespace):
+    # Lines converting `item` into `dest`, leaf class checks are inlined.
+    if isinstance(convert, types._Identity):
+        if convert.klass is object:
+            return [f"{dest} = item"]
+        klass = f"_klass_{index}"
+        namespace[klass] = convert.klass
+        return [
+            f"if item is not None and not isinstance(item, {klass}):",
+            f"    _validate(item, {klass})",
+            f"{dest} = item",
+        ]
+    name = f"_convert_{index}"
+    namespace[name] = convert
+    return [f"{dest} = None if item is None else {name}(item)"]
+
+
+def _generate(function,
+              argument,
+              prologue,
+              lookup,
+              dest,
+              epilogue,
+              schema,
+              converts,
+              namespace,
+              keys=None):
+    # `lookup` and `dest` are formatted with the `name` of each field,
+    # the `key` it is stored under, see `_stored_keys`, and its `index`.
+    lines = [f"def {function}({argument}):"]
+    lines.extend("    " + line for line in prologue)
+    for index, (name, convert) in enumerate(zip(schema, converts)):
+        key = name if keys is None else keys[name]
+        names = dict(name=repr(name), key=repr(key), index=index)
+        lines.extend("    " + line.format(**names) for line in lookup)
+        lines.append("    if item is not _NOVALUE:")
+        lines.extend(" " * 8 + line for line in _convert_lines(
+            convert, index, dest.format(**names), namespace))
+    lines.extend("    " + line for line in epilogue)
+    namespace.update(_NOVALUE=_NOVALUE, _validate=types.validate_class)
+    exec("\n".join(lines), namespace)
+    return namespace[function]
+
+
+def _lazy_encoder(schema, encoders, target, keys):
+    # Fields still undecoded are passed through when the target matches.
+    keys = [name if keys is None else keys[name] for name in schema]
+
+    def encode(value):
+        raw = value._raw
+        _unknown_field(raw, schema)
+        _unknown_field(value._fields, schema)
+        passthrough = value._source is target
+        result = {}
+        for name, key, convert in zip(schema, keys, encoders):
+            if passthrough and name in raw:
+                result[key] = raw[name]
+                continue
+            item = getattr(value, name, _NOVALUE)
+            if item is not _NOVALUE:
+                result[key] = None if item is None else convert(item)
+        return result
+
+    return encode
+
+
+def _compile_encoder(schema, klass, target, keys):
+    encoders = [type_._encoder(target) for type_ in schema.values()]
+    slots = getattr(klass, "_slots", None)
+    namespace = {
+        "_lazy_encode": _lazy_encoder(schema, encoders, target, keys),
+        "_schema": schema,
+        "_klass": klass,
+        "_unknown_field": _unknown_field
+    }
+    # Fields the schema does not know are rejected rather than dropped.
+    if slots is None:
+        prologue = [
+            "if value._raw:", "    return _lazy_encode(value)",
+            "fields = value._fields", "result = {}"
+        ]
+        lookup = ["item = fields.get({name}, _NOVALUE)"]
+        epilogue = [
+            "if len(result) != len(fields):",
+            "    _unknown_field(fields, _schema)",
+            "return result",
+        ]
+    else:
+        prologue = [
+            "if value.__class__ is not _klass:",
+            "    _validate(value, _klass)",
+            "if value._raw:", "    return _lazy_encode(value)", "result = {}"
+        ]
+        epilogue = ["return result"]
+        lookup = [
+            "try:",
+            "    item = _get_{index}(value)",
+            "except AttributeError:",
+            "    item = _NOVALUE",
+        ]
+        namespace.update({
+            f"_get_{index}": slots[name].__get__
+            for index, name in enumerate(schema)
+        })
+    return _generate(
+        "encode",
+        "value",
+        prologue=prologue,
+        lookup=lookup,
+        dest="result[{key}]",
+        epilogue=epilogue,
+        schema=schema,
+        converts=encoders,
+        namespace=namespace,
+        keys=keys)
+
+
+def _compile_decoder(schema, factory, source, keys):
+    return _generate(
+        "decode",
+        "jsony",
+        prologue=["kwargs = {}"],
+        lookup=["item = jsony.get({key}, _NOVALUE)"],
+        dest="kwargs[{name}]",
+        epilogue=[
+            "if len(kwargs) != len(jsony):",
+            "    _unknown_field(jsony, _stored)",
+            "return _factory(**kwargs)",
+        ],
+        schema=schema,
+        converts=[type_._decoder(source) for type_ in schema.values()],
+        namespace={
+            "_stored": schema if keys is None else set(keys.values()),
+            "_factory": factory,
+            "_unknown_field": _unknown_field
+        },
+        keys=keys)
+
+
+def _field_call(name, function, *args):
+    # Profiled under the path of the field when profiling.
+    if profiling.profiler is not None:
+        return profiling.profiler.field(name, function, *args)
+    return function(*args)
+
+
+def _trusted_factory(factory, schema):
+    """
+    Return a function building a struct from a dict of its fields without
+    checking their names, or `factory` when `__init__` must be called.
+    """
+    if isinstance(factory, _WithAttrsFactory):
+        klass, attrs = factory._klass, factory._attrs
+    else:
+        klass, attrs = factory, None
+    init = klass.__init__
+    if (issubclass(klass, SlotStruct) or not (
+            init is Struct.__init__ or getattr(init, "_generated", False))):
+        return lambda fields: factory(**fields)
+    defaults = [(name, type_) for name, type_ in schema.items()
+                if type_._default is not types.MISSING]
+
+    def build(fields):
+        value = klass.__new__(klass)
+        if attrs:
+            value.__dict__.update(attrs)
+        value.__dict__["_fields"] = fields
+        if len(fields) != len(schema):
+            for name, type_ in defaults:
+                if name in fields:
+                    continue
+                elif type_._default is types.REQUIRED:
+                    raise TypeError("Missing argument {}".format(name))
+                fields[name] = type_.default_value()
+        return value
+
+    return build
+
+
+def _compile_trusted_decoder(schema, factory, source, keys):
+    # Unknown fields are ignored rather than checked.
+    return _generate(
+        "decode",
+        "jsony",
+        prologue=["fields = {}"],
+        lookup=["item = jsony.get({key}, _NOVALUE)"],
+        dest="fields[{name}]",
+        epilogue=["return _build(fields)"],
+        schema=schema,
+        converts=[type_._trusted_decoder(source) for type_ in schema.values()],
+        namespace={"_build": _trusted_factory(factory, schema)},
+        keys=keys)
+
+
+def _to_jsony(struct, schema, target, keys=None):
+    fields = struct._load()
+    if keys is None:
+        return {
+            name: _field_call(name, schema[name].to_jsony, value, target)
+            for name, value in fields.items()
+        }
     return {
-        name: schema[name].to_jsony(value, target)
-        for name, value in struct._fields.items()
+        keys[name]: _field_call(name, schema[name].to_jsony, value, target)
+        for name, value in fields.items()
     }
 
 
-def _from_jsony(jsony, factory, schema, source):
+def _from_jsony(jsony, factory, schema, source, names=None):
+    if names is not None:
+        jsony = {names[key]: value for key, value in jsony.items()}
     return factory(
         **{
-            name: schema[name].from_jsony(value, source)
+            name: _field_call(name, schema[name].from_jsony, value, source)
             for name, value in jsony.items()
         })
 
@@ -120,30 +745,205 @@ class StructType(types.BasicType):
         self._factory = factory
         self._name = name
         self._toplevel_path = toplevel_path
+        # Mongo projection matching the fields of a type built by `project`.
+        self._projection = None
+
+    def _subtypes(self):
+        return self._schema.values()
+
+    def _is_aliased(self):
+        return (any(type_._alias is not None
+                    for type_ in self._schema.values())
+                or super(StructType, self)._is_aliased())
+
+    def _keys(self, target):
+        # Stored key of each field, None when they are the field names.
+        return self._cached(("keys", target),
+                            lambda: _stored_keys(self._schema, target))
+
+    def _names(self, source):
+        # Field name of each stored key, None when they are the field names.
+        def names():
+            keys = self._keys(source)
+            if keys is None:
+                return None
+            return {key: name for name, key in keys.items()}
 
-    def _apply(self, value, func):
+        return self._cached(("names", source), names)
+
+    def _apply(self, value, func, prune, inplace):
+        if inplace:
+            changes = {}
+            for name, field in value._load().items():
+                new_field = _field_call(name, self._schema[name].apply, field,
+                                        func, prune, True)
+                if new_field is not field:
+                    changes[name] = new_field
+            if isinstance(value, FrozenStruct):
+                value = evolve(value, **changes)
+            else:
+                for name, field in changes.items():
+                    setattr(value, name, field)
+            return func(self, value)
         kwargs = {
-            name: self._schema[name].apply(field, func)
-            for name, field in value._fields.items()
+            name: _field_call(name, self._schema[name].apply, field, func,
+                              prune)
+            for name, field in value._load().items()
         }
         return func(self, self._factory(**kwargs))
 
     def _to_jsony(self, value, target):
-        return _to_jsony(value, self._schema, target)
+        return _to_jsony(value, self._schema, target, self._keys(target))
 
     def _from_jsony(self, jsony, source):
-        return _from_jsony(jsony, self._factory, self._schema, source)
+        return _from_jsony(jsony, self._factory, self._schema, source,
+                           self._names(source))
+
+    def _encoder(self, target):
+        return _compile_encoder(self._schema, self._klass, target,
+                                self._keys(target))
+
+    def _decoder(self, source):
+        return _compile_decoder(self._schema, self._factory, source,
+                                self._keys(source))
+
+    def _trusted_decoder(self, source):
+        return _compile_trusted_decoder(self._schema, self._factory, source,
+                                        self._keys(source))
+
+    def _binary_codec(self):
+        return binary.struct_codec(
+            self._schema, _trusted_factory(self._factory, self._schema))
+
+    def _from_jsony_lazy(self, jsony, source):
+        value = _empty_struct(self._factory)
+        raw = dict(jsony)
+        names = self._names(source)
+        if names is None:
+            _unknown_field(raw, self._schema)
+        else:
+            _unknown_field(raw, names)
+            raw = {names[key]: item for key, item in raw.items()}
+        for name, type_ in self._schema.items():
+            if name in raw or type_._default is types.MISSING:
+                continue
+            elif type_._default is types.REQUIRED:
+                raise TypeError("Missing argument {}".format(name))
+            value._store(name, type_.default_value())
+        value.__dict__["_raw"] = raw
+        value.__dict__["_source"] = source
+        if profiling.profiler is not None:
+            value.__dict__["_profile_path"] = profiling.profiler.path()
+        return value
 
     def new(self, *args, **kwargs):
         return self._factory(*args, **kwargs)
 
+    def _field_decoders(self, source):
+        # Field name and decoder of each stored key, cached with the compiled
+        # codecs.
+        def decoders():
+            keys = self._keys(source) or {}
+            return {
+                keys.get(name, name): (name, type_.compile(source).from_jsony)
+                for name, type_ in self._schema.items()
+            }
+
+        return self._cached(("fields", source), decoders)
+
     def field(self, name):
         return self._schema[name]
 
+    def _path_type(self, path):
+        type_ = self
+        for name in path.split("."):
+            type_ = type_.field(name)
+        return type_
+
     @property
     def fields(self):
         return self._schema
 
+    def stored_path(self, path):
+        """
+        Return the dotted `path` of field names with each field replaced by
+        the key it is stored under in BSON documents, see `BasicType.alias`,
+        for use in MongoDB queries. List indices, operators such as `$`
+        and parts which are not fields are kept as is.
+        """
+        return self._stored_path_type(path)[0]
+
+    def _stored_path_type(self, path):
+        # `stored_path` of `path` and the type it selects, None if some
+        # part is not a field or if no field is aliased.
+        if not self._aliased:
+            return path, None
+        parts = path.split(".")
+        type_ = self
+        index = 0
+        while index < len(parts):
+            while isinstance(type_, types.Placeholder):
+                type_ = type_._type
+            part = parts[index]
+            if isinstance(type_, types._List):
+                # Fields of items can be selected without index.
+                type_ = type_._get_parameter()
+                if part.isdigit() or part.startswith("$"):
+                    index += 1
+                continue
+            elif isinstance(type_, StructType) and part in type_._schema:
+                keys = type_._keys(types.BSON)
+                if keys is not None:
+                    parts[index] = keys[part]
+                type_ = type_._schema[part]
+            elif isinstance(type_, types._Dict):
+                type_ = type_._get_parameters()[1]
+            else:
+                type_ = None
+                break
+            index += 1
+        return ".".join(parts), type_
+
+    def project(self, *paths):
+        """
+        Return an anonymous struct type with only the fields given by
+        `paths`. Dotted paths select fields of nested structs
+        or lists of structs.
+        """
+        nested = {}
+        for path in paths:
+            name, _, rest = path.partition(".")
+            if name not in self._schema:
+                raise KeyError(path)
+            if not rest:
+                nested[name] = None
+            elif name not in nested:
+                nested[name] = [rest]
+            elif nested[name] is not None:
+                nested[name].append(rest)
+
+        schema = {}
+        for name, type_ in self._schema.items():
+            if name not in nested:
+                continue
+            elif nested[name] is not None:
+                type_ = _project_type(type_, nested[name])
+            schema[name] = type_
+        projected = lambda_struct(**schema)
+
+        projection = {}
+        for path in sorted(paths):
+            if not any(path.startswith(other + ".") for other in projection):
+                projection[path] = 1
+        projection = {
+            self.stored_path(path): include
+            for path, include in projection.items()
+        }
+        if "_id" not in schema:
+            projection["_id"] = 0
+        projected._projection = projection
+        return projected
+
     def __copy__(self):
         copied = self.__class__.__new__(self.__class__)
         copied.__dict__.update(self.__dict__)
@@ -192,12 +992,55 @@ class _WithAttrsFactory:
         return not (self == other)
 
 
-def struct(__name, __bases=(), **schema):
-    klass = type(__name, __bases + (Struct, ), {})
+def _project_type(type_, paths):
+    if isinstance(type_, StructType):
+        projected = type_.project(*paths)
+        return projected._change(default=type_._default, alias=type_._alias)
+    elif isinstance(type_, types._List):
+        parameter = type_._get_parameter()
+        if isinstance(parameter, StructType):
+            projected = types.List[parameter.project(*paths)]
+            return projected._change(default=type_._default,
+                                     alias=type_._alias)
+    raise ValueError(f"Cannot project paths {paths} of type {type_.name}")
+
+
+def _empty_struct(factory):
+    # New struct instance with no field set, bypassing `__init__`.
+    if isinstance(factory, _WithAttrsFactory):
+        klass = factory._klass
+        value = klass.__new__(klass)
+        value.__dict__.update(factory._attrs)
+    else:
+        value = factory.__new__(factory)
+    if not isinstance(value, SlotStruct):
+        value.__dict__["_fields"] = {}
+    return value
+
+
+def struct(__name, __bases=(), __slots=False, __frozen=False, **schema):
+    """
+    Define a named struct. With `__slots=True`, field values are stored
+    in slots instead of a per instance dict, saving memory and making
+    attribute access faster. With `__frozen=True`, fields cannot be
+    modified, see `FrozenStruct`.
+    """
+    # Fields stored under the same key are rejected up front.
+    _stored_keys(schema, types.BSON)
+    if __frozen:
+        __bases = __bases + (FrozenStruct, )
+    if __slots:
+        klass = type(__name, __bases + (SlotStruct, ),
+                     {"__slots__": tuple(schema)})
+        klass._slots = {name: klass.__dict__[name] for name in schema}
+    else:
+        klass = type(__name, __bases + (Struct, ), {})
     module = top_calling_module_name()
     klass.__module__ = module
     klass.__qualname__ = f"{__name}.{__name}"
     klass._schema = schema
+    if klass.__init__ is Struct.__init__ and _argument_names(schema):
+        klass.__init__ = _make_init(klass, schema)
     factory = klass
     type_ = StructType(
         schema=schema,
@@ -210,6 +1053,7 @@ def struct(__name, __bases=(), **schema):
 
 
 def lambda_struct(__name=None, **schema):
+    _stored_keys(schema, types.BSON)
     klass = Struct
     factory = _WithAttrsFactory(klass, _schema=schema)
     type_ = StructType(
@@ -1,62 +1,153 @@
+import warnings
+
 import numpy as np
 import torch
 
-from .types import BasicType, validate_class, BSON, JSON
+from . import binary, blobs
+from .numpy import _array, _decode, _encode, _read, _write
+from .types import BasicType, validate_class, JSON
 
 
 class _Tensor(BasicType):
-    def __init__(self, *, klass=torch.Tensor, **kwargs):
+    def __init__(self,
+                 *,
+                 klass=torch.Tensor,
+                 shared=False,
+                 compact=False,
+                 compress=False,
+                 store=None,
+                 **kwargs):
         super().__init__(klass=klass, **kwargs)
+        self._shared = shared
+        self._compact = compact
+        self._compress = compress
+        self._store = store
+
+    @property
+    def name(self):
+        return "Tensor" if self._store is None else "ExternalTensor"
+
+    def __eq__(self, other):
+        if not super().__eq__(other):
+            return False
+        return ((self._shared, self._compact, self._compress, self._store) ==
+                (other._shared, other._compact, other._compress, other._store))
+
+    @property
+    def shared(self):
+        # Decode tensors from BSON and binary data without copying, sharing
+        # the memory of the document. Torch has no read-only tensors, so
+        # they must not be modified in place.
+        return self._change(shared=True)
+
+    def compact(self, compress=False):
+        # Export to JSON as base64 of the raw buffer rather than nested lists,
+        # optionally zlib compressed. Both forms are accepted when decoding.
+        return self._change(compact=True, compress=compress)
+
+    def external(self, store):
+        # Write tensors to `store`, see `blobs.DirectoryStore`, keeping only
+        # a reference in documents. Decoded tensors are copy on write
+        # mappings of the blob, documents with inline tensors are still
+        # accepted.
+        return self._change(store=store)
 
     def _to_jsony(self, value, target):
         validate_class(value, self.klass)
-        value = value.numpy()
-        if target is JSON:
+        value = value.detach().cpu().numpy()
+        if self._store is not None:
+            return blobs.dump(self._store, value)
+        if target is JSON and not self._compact:
             return value.tolist()
-        elif target is BSON:
-            return {
-                "shape": value.shape,
-                "content": value.tobytes(),
-            }
-        else:
-            raise ValueError(f"Unsupported target {target}")
+        value = np.require(value, requirements="C")
+        return _encode(value, target, self._compress)
 
     def _from_jsony(self, jsony, source):
-        if source is JSON or isinstance(jsony, list):
-            validate_class(jsony, list)
+        if isinstance(jsony, list):
             return torch.from_numpy(np.array(jsony, dtype=np.float32))
-        elif source is BSON:
-            validate_class(jsony, dict)
-            validate_class(jsony['content'], bytes)
-            validate_class(jsony['shape'], list)
-            value = np.fromstring(jsony['content'], dtype=np.float32)
-            return torch.from_numpy(value).view(*jsony['shape'])
-        else:
-            raise ValueError(f"Unsupported source {source}")
+        validate_class(jsony, dict)
+        if self._store is not None and "blob" in jsony:
+            value = blobs.load(self._store, jsony)
+            if not value.dtype.isnative:
+                value = value.astype(value.dtype.newbyteorder("="))
+            return torch.from_numpy(value)
+        if 'dtype' not in jsony:
+            # Documents written before the dtype was stored are float32.
+            jsony = dict(jsony, dtype=np.dtype(np.float32).str)
+        return self._from_buffer(*_decode(jsony, source))
+
+    def _from_buffer(self, content, dtype, shape, order):
+        value = _array(content, dtype, shape, order, not self._shared)
+        if value.flags.writeable:
+            return torch.from_numpy(value)
+        with warnings.catch_warnings():
+            # Read-only memory was asked for with `shared`.
+            warnings.filterwarnings("ignore", "The given NumPy array")
+            return torch.from_numpy(value)
+
+    def _binary_codec(self):
+        if self._store is not None:
+            return binary.json_codec(self)
+
+        def write(value, out):
+            validate_class(value, self.klass)
+            value = value.detach().cpu().numpy()
+            _write(np.require(value, requirements="C"), out)
+
+        def read(data, pos):
+            parts, pos = _read(data, pos)
+            return self._from_buffer(*parts), pos
+
+        return write, read
 
 
 Tensor = _Tensor()
 
 
 class _FloatOrTensor(BasicType):
-    def __init__(self, *, klass=float, **kwargs):
+    def __init__(self, *, klass=float, tensor=Tensor, **kwargs):
         super().__init__(klass=klass, **kwargs)
+        self._tensor = tensor
 
     @property
     def name(self):
         return "FloatOrTensor"
 
+    def compact(self, compress=False):
+        return self._change(tensor=self._tensor.compact(compress))
+
+    def external(self, store):
+        return self._change(tensor=self._tensor.external(store))
+
     def _to_jsony(self, value, target):
         if isinstance(value, (int, float)):
             return float(value)
         else:
-            return Tensor.to_jsony(value, target)
+            return self._tensor.to_jsony(value, target)
 
     def _from_jsony(self, value, source):
         if isinstance(value, (int, float)):
             return value
         else:
-            return Tensor.from_jsony(value, source)
+            return self._tensor.from_jsony(value, source)
+
+    def _binary_codec(self):
+        write_tensor, read_tensor = binary.codec(self._tensor)
+
+        def write(value, out):
+            if isinstance(value, (int, float)):
+                out.append(0)
+                binary.write_float(value, out)
+            else:
+                out.append(1)
+                write_tensor(value, out)
+
+        def read(data, pos):
+            if data[pos] == 0:
+                return binary.read_float(data, pos + 1)
+            return read_tensor(data, pos + 1)
+
+        return write, read
 
 
 FloatOrTensor = _FloatOrTensor()
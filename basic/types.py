@@ -1,11 +1,12 @@
 import base64
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import copy
 import datetime
 import functools
 import itertools
 import pathlib
 
+from . import binary, profiling
 from .utils import _Keyword
 
 
@@ -24,22 +25,45 @@ NOW = DefaultValue("NOW")
 
 JSON = Target("JSON")
 BSON = Target("BSON")
+# Compact binary encoding from the schema, see `basic.binary`.
+BINARY = Target("BINARY")
+
+# Pair of functions returned by `BasicType.compile`, both accept None.
+Codec = namedtuple("Codec", ["to_jsony", "from_jsony"])
 
 
 class BasicType:
+    # Name of the field in BSON documents when the type is that of a field,
+    # see `alias`.
+    _alias = None
+
     def __init__(self, *, klass, default=REQUIRED):
         self._default = default
         self._klass = klass
+        self._compiled = {}
 
     def _change(self, **change):
         new_type = copy.copy(self)
         for name, value in change.items():
             setattr(new_type, "_" + name, value)
+        new_type._compiled = {}
         return new_type
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_compiled"] = {}
+        return state
+
     def default(self, default):
         return self._change(default=default)
 
+    def alias(self, name):
+        """
+        Store the struct field of this type under `name` in BSON documents,
+        the attribute keeping the name of the field.
+        """
+        return self._change(alias=name)
+
     @property
     def none(self):
         return self.default(None)
@@ -73,7 +97,13 @@ class BasicType:
     def __eq__(self, other):
         if self.__class__ != other.__class__:
             return False
-        return (self._default, self._klass) == (other._default, other._klass)
+        return ((self._klass, self._alias) == (other._klass, other._alias)
+                and self._equal_default(other._default))
+
+    def _equal_default(self, default):
+        # Types whose values do not compare to a bool, such as arrays,
+        # override this.
+        return self._default == default
 
     def __ne__(self, other):
         return not (self == other)
@@ -102,33 +132,173 @@ class BasicType:
     def to_jsony(self, value, target):
         if value is None:
             return None
+        if profiling.profiler is not None:
+            return profiling.profiler.call("to_jsony", self, self._to_jsony,
+                                           value, target)
         return self._to_jsony(value, target=target)
 
-    def from_jsony(self, jsony, source):
+    def _from_jsony_lazy(self, jsony, source):
+        return self.compile(source).from_jsony(jsony)
+
+    def from_jsony(self, jsony, source, lazy=False):
+        """
+        With `lazy=True`, structs keep the fields of `jsony` undecoded
+        until they are first accessed.
+        """
         if jsony is None:
             return None
+        if lazy:
+            return self._from_jsony_lazy(jsony, source)
+        if profiling.profiler is not None:
+            return profiling.profiler.call("from_jsony", self,
+                                           self._from_jsony, jsony, source)
         return self._from_jsony(jsony, source=source)
 
-    def from_json(self, json):
-        return self.from_jsony(json, source=JSON)
-
-    def from_bson(self, bson):
-        return self.from_jsony(bson, source=BSON)
+    def _encoder(self, target):
+        return functools.partial(self._to_jsony, target=target)
+
+    def _decoder(self, source):
+        return functools.partial(self._from_jsony, source=source)
+
+    def _binary_codec(self):
+        return binary.json_codec(self)
+
+    def _trusted_decoder(self, source):
+        # Decoder assuming the input matches the type, class checks are
+        # skipped.
+        decoder = self._decoder(source)
+        if isinstance(decoder, _Identity):
+            return _Identity()
+        return decoder
+
+    def compile(self, target, trusted=False):
+        """
+        Return a `Codec` specialized for `target`, cached on the type.
+        Changing the type (default, parameters...) gives a new cache.
+        With `trusted=True`, the decoder does not validate its input,
+        which must have been produced by the encoder of the same type.
+        While profiling, the generic conversions are returned instead.
+        For `BINARY`, the codec converts between values and bytes.
+        """
+        if target is BINARY:
+            try:
+                return self._compiled[BINARY]
+            except KeyError:
+                pass
+            codec = self._compiled[BINARY] = binary._compile(self)
+            return codec
+        if profiling.profiler is not None:
+            return Codec(
+                functools.partial(self.to_jsony, target=target),
+                functools.partial(self.from_jsony, source=target))
+        key = (target, "trusted") if trusted else target
+        try:
+            return self._compiled[key]
+        except KeyError:
+            pass
+        if trusted:
+            codec = Codec(
+                self.compile(target).to_jsony,
+                _none_guard(self._trusted_decoder(target)))
+        else:
+            codec = Codec(
+                _none_guard(self._encoder(target)),
+                _none_guard(self._decoder(target)))
+        self._compiled[key] = codec
+        return codec
+
+    def from_json(self, json, lazy=False, trusted=False):
+        if lazy:
+            return self.from_jsony(json, JSON, lazy=True)
+        return self.compile(JSON, trusted).from_jsony(json)
+
+    def from_bson(self, bson, lazy=False, trusted=False):
+        """
+        Use `trusted=True` only for documents written by `to_bson` with the
+        same type, such as those read back from our own collections.
+        """
+        if lazy:
+            return self.from_jsony(bson, BSON, lazy=True)
+        return self.compile(BSON, trusted).from_jsony(bson)
 
     def to_json(self, json):
-        return self.to_jsony(json, target=JSON)
+        return self.compile(JSON).to_jsony(json)
 
     def to_bson(self, bson):
-        return self.to_jsony(bson, target=BSON)
-
-    def apply(self, value, func):
+        return self.compile(BSON).to_jsony(bson)
+
+    def to_jsony_many(self, values, target):
+        to_jsony = self.compile(target).to_jsony
+        return [to_jsony(value) for value in values]
+
+    def from_jsony_many(self, jsonys, source, trusted=False):
+        from_jsony = self.compile(source, trusted).from_jsony
+        return [from_jsony(jsony) for jsony in jsonys]
+
+    def from_json_many(self, jsons, trusted=False):
+        return self.from_jsony_many(jsons, source=JSON, trusted=trusted)
+
+    def from_bson_many(self, bsons, trusted=False):
+        return self.from_jsony_many(bsons, source=BSON, trusted=trusted)
+
+    def to_json_many(self, values):
+        return self.to_jsony_many(values, target=JSON)
+
+    def to_bson_many(self, values):
+        return self.to_jsony_many(values, target=BSON)
+
+    def apply(self, value, func, prune=None, inplace=False):
+        """
+        Return `func(type, value)` where the parts of `value` have already
+        been transformed the same way, bottom-up.
+        Values of a type for which `prune(type)` is true are returned as is,
+        without calling `func` on them or their parts.
+        With `inplace`, lists, dicts and structs are modified instead of
+        being rebuilt, including those `value` shares with other values.
+        """
+        if prune is not None and prune(self):
+            return value
         if value is None:
             return func(self, value)
-        return self._apply(value, func)
+        if profiling.profiler is not None:
+            return profiling.profiler.call("apply", self, self._apply, value,
+                                           func, prune, inplace)
+        return self._apply(value, func, prune, inplace)
 
-    def _apply(self, value, func):
+    def _apply(self, value, func, prune, inplace):
         return func(self, value)
 
+    def _subtypes(self):
+        # Types of the parts of a value, see `_convertible`.
+        return ()
+
+    def _cached(self, key, compute):
+        # Property of the type computed once, reset by `_change`.
+        try:
+            return self._compiled[key]
+        except KeyError:
+            pass
+        value = compute()
+        self._compiled[key] = value
+        return value
+
+    def _is_convertible(self):
+        return any(type_._convertible for type_ in self._subtypes())
+
+    @property
+    def _convertible(self):
+        # Whether a value may contain a struct that `inspection.convert`
+        # turns into an object.
+        return self._cached("convertible", self._is_convertible)
+
+    def _is_aliased(self):
+        return any(type_._aliased for type_ in self._subtypes())
+
+    @property
+    def _aliased(self):
+        # Whether a value may contain a struct with aliased fields.
+        return self._cached("aliased", self._is_aliased)
+
     def __repr__(self):
         name = self.name
         if self._default is REQUIRED:
@@ -147,13 +317,72 @@ def validate_class(value, klass):
     return value
 
 
+class _Identity:
+    """
+    Conversion returned by `_encoder`/`_decoder` when the value is
+    kept as is once its class has been checked. Template and struct types
+    inline the check instead of calling it.
+    """
+
+    def __init__(self, klass=object):
+        self.klass = klass
+
+    def __call__(self, value):
+        return validate_class(value, self.klass)
+
+
+def _check_all(values, klass):
+    if klass is object:
+        return
+    for value in values:
+        if value is not None and not isinstance(value, klass):
+            validate_class(value, klass)
+
+
+def _none_guard(convert):
+    if isinstance(convert, _Identity):
+        klass = convert.klass
+        if klass is object:
+            return lambda value: value
+
+        def guarded(value):
+            if value is not None and not isinstance(value, klass):
+                validate_class(value, klass)
+            return value
+    else:
+
+        def guarded(value):
+            if value is None:
+                return None
+            return convert(value)
+
+    return guarded
+
+
 class BuiltinType(BasicType):
+    def _binary_codec(self):
+        codec = {
+            bool: binary.BOOL,
+            int: binary.INT,
+            str: binary.STR,
+            object: binary.ANY,
+        }.get(self.klass)
+        if codec is None:
+            return super(BuiltinType, self)._binary_codec()
+        return codec
+
     def _to_jsony(self, value, target):
         return validate_class(value, self.klass)
 
     def _from_jsony(self, jsony, source):
         return validate_class(jsony, self.klass)
 
+    def _encoder(self, target):
+        return _Identity(self.klass)
+
+    def _decoder(self, source):
+        return _Identity(self.klass)
+
 
 class _Any(BuiltinType):
     def __init__(self, *, klass=object, **kwargs):
@@ -167,6 +396,12 @@ class _Any(BuiltinType):
         return "Any"
 
 
+def _to_float(value):
+    if value.__class__ is float:
+        return value
+    return float(validate_class(value, (float, int)))
+
+
 class _Float(BasicType):
     def __init__(self, *, klass=float, **kwargs):
         super(_Float, self).__init__(klass=klass, **kwargs)
@@ -177,6 +412,18 @@ class _Float(BasicType):
     def _from_jsony(self, jsony, source):
         return float(validate_class(jsony, (float, int)))
 
+    def _encoder(self, target):
+        return _to_float
+
+    def _decoder(self, source):
+        return _to_float
+
+    def _trusted_decoder(self, source):
+        return _Identity()
+
+    def _binary_codec(self):
+        return binary.FLOAT
+
 
 class _Datetime(BasicType):
     def __init__(self, *, klass=datetime.datetime, **kwargs):
@@ -208,6 +455,26 @@ class _Datetime(BasicType):
         else:
             raise ValueError(f"Unsupported target {target}")
 
+    def _encoder(self, target):
+        if target is JSON:
+            return str
+        elif target is BSON:
+            return _Identity()
+        return super(_Datetime, self)._encoder(target)
+
+    def _decoder(self, source):
+        if source is JSON:
+            return datetime.datetime.fromisoformat
+        elif source is BSON:
+            return _Identity()
+        return super(_Datetime, self)._decoder(source)
+
+    def _binary_codec(self):
+        return binary.mapped(
+            binary.STR,
+            lambda value: validate_class(value, self.klass).isoformat(),
+            datetime.datetime.fromisoformat)
+
 
 class _Path(BasicType):
     def __init__(self, *, klass=pathlib.Path, **kwargs):
@@ -219,12 +486,34 @@ class _Path(BasicType):
     def _to_jsony(self, value, target):
         return str(value)
 
+    def _binary_codec(self):
+        return binary.mapped(binary.STR, str, self.new)
+
 
 class _Bytes(BasicType):
-    def __init__(self, *, klass=bytes, **kwargs):
+    def __init__(self, *, klass=bytes, store=None, **kwargs):
         super(_Bytes, self).__init__(klass=klass, **kwargs)
+        self._store = store
+
+    @property
+    def name(self):
+        return "Bytes" if self._store is None else "ExternalBytes"
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self._store == other._store
+
+    def external(self, store):
+        """
+        Write values to `store`, see `blobs.DirectoryStore`, keeping only
+        a reference in documents. Values are decoded as read-only
+        memoryviews of the memory mapped blobs.
+        """
+        return self._change(store=store)
 
     def _from_jsony(self, jsony, source):
+        if self._store is not None and isinstance(jsony, dict):
+            from . import blobs
+            return memoryview(blobs.load(self._store, jsony)).toreadonly()
         if source is JSON:
             return base64.b85decode(jsony)
         elif source is BSON:
@@ -233,6 +522,10 @@ class _Bytes(BasicType):
             raise ValueError(f"Unsupported source {source}")
 
     def _to_jsony(self, value, target):
+        if self._store is not None:
+            from . import blobs
+            return blobs.dump(self._store, validate_class(
+                value, (bytes, bytearray, memoryview)))
         if target is JSON:
             return base64.b85encode(value).decode('ascii')
         elif target is BSON:
@@ -240,6 +533,21 @@ class _Bytes(BasicType):
         else:
             raise ValueError(f"Unsupported target {target}")
 
+    def _encoder(self, target):
+        if target is BSON and self._store is None:
+            return _Identity(self.klass)
+        return super(_Bytes, self)._encoder(target)
+
+    def _decoder(self, source):
+        if source is BSON and self._store is None:
+            return _Identity(self.klass)
+        return super(_Bytes, self)._decoder(source)
+
+    def _binary_codec(self):
+        if self._store is not None:
+            return binary.json_codec(self)
+        return binary.BYTES
+
 
 class Enum(BasicType):
     def __init__(self, *, klass, **kwargs):
@@ -251,6 +559,11 @@ class Enum(BasicType):
     def _to_jsony(self, value, target):
         return validate_class(value, self.klass).value
 
+    def _binary_codec(self):
+        return binary.mapped(
+            binary.INT, lambda value: validate_class(value, self.klass).value,
+            self.new)
+
 
 Int = BuiltinType(klass=int)
 Str = BuiltinType(klass=str)
@@ -263,6 +576,52 @@ Float = _Float()
 Path = _Path()
 
 
+def _list_codec(convert):
+    if isinstance(convert, _Identity):
+        klass = convert.klass
+
+        def codec(value):
+            value = list(value)
+            _check_all(value, klass)
+            return value
+    else:
+        convert = _none_guard(convert)
+
+        def codec(value):
+            return [convert(item) for item in value]
+
+    return codec
+
+
+def _dict_codec(convert_key, convert_value):
+    if isinstance(convert_key, _Identity):
+        key_klass = convert_key.klass
+        if isinstance(convert_value, _Identity):
+            value_klass = convert_value.klass
+
+            def codec(value):
+                _check_all(value, key_klass)
+                _check_all(value.values(), value_klass)
+                return dict(value)
+        else:
+            convert_value = _none_guard(convert_value)
+
+            def codec(value):
+                _check_all(value, key_klass)
+                return {k: convert_value(v) for k, v in value.items()}
+    else:
+        convert_key = _none_guard(convert_key)
+        convert_value = _none_guard(convert_value)
+
+        def codec(value):
+            return {
+                convert_key(k): convert_value(v)
+                for k, v in value.items()
+            }
+
+    return codec
+
+
 def _as_tuple(value):
     if not isinstance(value, tuple):
         return (value, )
@@ -315,9 +674,17 @@ class _List(TemplateType):
         else:
             return Any
 
-    def _apply(self, value, func):
+    def _subtypes(self):
+        return (self._get_parameter(), )
+
+    def _apply(self, value, func, prune, inplace):
         parameter = self._get_parameter()
-        return func(self, [parameter.apply(item, func) for item in value])
+        if inplace:
+            for index, item in enumerate(value):
+                value[index] = parameter.apply(item, func, prune, True)
+            return func(self, value)
+        return func(self,
+                    [parameter.apply(item, func, prune) for item in value])
 
     def _from_jsony(self, jsony, source):
         parameter = self._get_parameter()
@@ -327,6 +694,18 @@ class _List(TemplateType):
         parameter = self._get_parameter()
         return [parameter.to_jsony(item, target) for item in value]
 
+    def _encoder(self, target):
+        return _list_codec(self._get_parameter()._encoder(target))
+
+    def _decoder(self, source):
+        return _list_codec(self._get_parameter()._decoder(source))
+
+    def _trusted_decoder(self, source):
+        return _list_codec(self._get_parameter()._trusted_decoder(source))
+
+    def _binary_codec(self):
+        return binary.list_codec(self._get_parameter())
+
 
 class _Dict(TemplateType):
     def __init__(self, *, klass=dict, **kwargs):
@@ -347,13 +726,19 @@ class _Dict(TemplateType):
         else:
             return Any, Any
 
-    def _apply(self, value, func):
+    def _subtypes(self):
+        return self._get_parameters()
+
+    def _apply(self, value, func, prune, inplace):
         key_type, value_type = self._get_parameters()
-        return func(
-            self, {
-                key_type.apply(k, func): value_type.apply(v, func)
-                for k, v in value.items()
-            })
+        items = [(key_type.apply(k, func, prune),
+                  value_type.apply(v, func, prune, inplace))
+                 for k, v in value.items()]
+        if inplace:
+            value.clear()
+            value.update(items)
+            return func(self, value)
+        return func(self, dict(items))
 
     def _from_jsony(self, jsony, source):
         key_type, value_type = self._get_parameters()
@@ -369,6 +754,25 @@ class _Dict(TemplateType):
             for k, v in value.items()
         }
 
+    def _encoder(self, target):
+        key_type, value_type = self._get_parameters()
+        return _dict_codec(
+            key_type._encoder(target), value_type._encoder(target))
+
+    def _decoder(self, source):
+        key_type, value_type = self._get_parameters()
+        return _dict_codec(
+            key_type._decoder(source), value_type._decoder(source))
+
+    def _trusted_decoder(self, source):
+        key_type, value_type = self._get_parameters()
+        return _dict_codec(
+            key_type._trusted_decoder(source),
+            value_type._trusted_decoder(source))
+
+    def _binary_codec(self):
+        return binary.dict_codec(*self._get_parameters())
+
 
 class _DefaultDict(_Dict):
     def __init__(self, *, klass=defaultdict, **kwargs):
@@ -385,6 +789,19 @@ class _DefaultDict(_Dict):
     def _from_jsony(self, jsony, source):
         return self.new(super(_DefaultDict, self)._from_jsony(jsony, source))
 
+    def _decoder(self, source):
+        decode = super(_DefaultDict, self)._decoder(source)
+        return lambda jsony: self.new(decode(jsony))
+
+    def _trusted_decoder(self, source):
+        decode = super(_DefaultDict, self)._trusted_decoder(source)
+        return lambda jsony: self.new(decode(jsony))
+
+    def _binary_codec(self):
+        return binary.mapped(
+            super(_DefaultDict, self)._binary_codec(), lambda value: value,
+            self.new)
+
 
 class _Tuple(TemplateType):
     def __init__(self, *, klass=tuple, **kwargs):
@@ -400,11 +817,15 @@ class _Tuple(TemplateType):
             parameters = itertools.repeat(Any)
         return parameters
 
-    def _apply(self, value, func):
+    def _subtypes(self):
+        return self._parameters or (Any, )
+
+    def _apply(self, value, func, prune, inplace):
+        # Tuples are immutable, only their items are modified in place.
         parameters = self._get_parameters(value)
         return func(self,
                     tuple([
-                        parameter.apply(item, func)
+                        parameter.apply(item, func, prune, inplace)
                         for parameter, item in zip(parameters, value)
                     ]))
 
@@ -422,6 +843,38 @@ class _Tuple(TemplateType):
             for parameter, i in zip(parameters, jsony)
         ])
 
+    def _codec(self, converts, build):
+        if self._parameters is None:
+            return build
+        converts = [_none_guard(convert) for convert in converts]
+        check_length = self._get_parameters
+
+        def codec(value):
+            check_length(value)
+            return build([
+                convert(item) for convert, item in zip(converts, value)
+            ])
+
+        return codec
+
+    def _encoder(self, target):
+        return self._codec(
+            [p._encoder(target) for p in self._parameters or ()], list)
+
+    def _decoder(self, source):
+        return self._codec(
+            [p._decoder(source) for p in self._parameters or ()], tuple)
+
+    def _trusted_decoder(self, source):
+        return self._codec(
+            [p._trusted_decoder(source) for p in self._parameters or ()],
+            tuple)
+
+    def _binary_codec(self):
+        if self._parameters is None:
+            return binary.mapped(binary.ANY, list, tuple)
+        return binary.tuple_codec(self._parameters)
+
 
 List = _List()
 Dict = _Dict()
@@ -478,9 +931,27 @@ class Placeholder(BasicType):
     _to_jsony = _forward("_to_jsony")
     _from_jsony = _forward("_from_jsony")
     _apply = _forward("_apply")
+
+    # Not resolved, as the type may contain this placeholder.
+    _convertible = True
+    _aliased = True
     new = _forward("new")
     __repr__ = _forward("__repr__")
 
+    # Resolved lazily so that recursive types compile.
+    def _encoder(self, target):
+        return lambda value: self._type.compile(target).to_jsony(value)
+
+    def _decoder(self, source):
+        return lambda jsony: self._type.compile(source).from_jsony(jsony)
+
+    def _trusted_decoder(self, source):
+        return lambda jsony: self._type.compile(source, True).from_jsony(jsony)
+
+    def _binary_codec(self):
+        return (lambda value, out: binary.codec(self._type)[0](value, out),
+                lambda data, pos: binary.codec(self._type)[1](data, pos))
+
     @property
     @_forward_if
     def name(self):
@@ -2,9 +2,21 @@ from copy import deepcopy
 import sys
 
 
+_KEYWORDS = {}
+
+
+def _get_keyword(name):
+    return _KEYWORDS[name]
+
+
 class _Keyword:
+    # Keywords are compared by identity, so they are unpickled by name.
     def __init__(self, name):
         self._name = name
+        _KEYWORDS[name] = self
+
+    def __reduce__(self):
+        return _get_keyword, (self._name, )
 
     def __repr__(self):
         return self._name
@@ -13,21 +25,36 @@ class _Keyword:
         return self._name
 
 
-def set_path(args, path, value):
+def set_path(args, path, value, owned=None):
+    """
+    If `owned` is a set of ids, dicts along `path` not in it are copied
+    before being modified, and the ids of the copies are added to it.
+    """
     parts = path.split(".")
     for part in parts[:-1]:
         if part not in args:
             args[part] = {}
+            if owned is not None:
+                owned.add(id(args[part]))
+        elif owned is not None and id(args[part]) not in owned:
+            args[part] = dict(args[part])
+            owned.add(id(args[part]))
         args = args[part]
     args[parts[-1]] = value
 
 
 def unflatten(args, base=None, copy=True):
+    """
+    With `copy=False`, values are not copied and shared with `args`,
+    only the dicts on the path of a later value are copied (copy on write),
+    so that `args` is never modified.
+    """
     base = {} if base is None else base
+    owned = None if copy else {id(base)}
     for path, value in args.items():
         if copy:
             value = deepcopy(value)
-        set_path(base, path, value)
+        set_path(base, path, value, owned)
     return base
 
 
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Check that `import basic` stays fast and does not import heavy
+# optional dependencies. Exits with an error code on regression.
+import argparse
+from pathlib import Path
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ["torch", "numpy", "bson", "pymongo"]
+
+_SCRIPT = f"""
+import sys, time
+begin = time.perf_counter()
+import basic
+print(time.perf_counter() - begin)
+print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+
+def measure(runs):
+    best = None
+    heavy = set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", _SCRIPT],
+                                cwd=ROOT,
+                                check=True,
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        duration, imported = output.splitlines()
+        heavy.update(filter(None, imported.split(",")))
+        duration = float(duration)
+        best = duration if best is None else min(best, duration)
+    return best, sorted(heavy)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=0.2)
+    args = parser.parse_args()
+
+    duration, heavy = measure(args.runs)
+    print(f"import basic: {duration * 1000:.1f}ms")
+    failed = False
+    if heavy:
+        print(f"error: import basic imported {', '.join(heavy)}")
+        failed = True
+    if duration > args.max_seconds:
+        print(f"error: import basic took more than {args.max_seconds}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# Throughput and peak memory of the main operations of basic.
+#
+#   benchmarks/run.py                      run all benchmarks on this tree
+#   benchmarks/run.py -k bson --json x     only those matching, save results
+#   benchmarks/run.py --compare v1 HEAD    compare two git revisions
+#
+# The benchmarks defined here are run against each revision, so they only
+# use APIs available in all the revisions being compared. Benchmarks that
+# fail, for instance on a revision missing an API, are reported as errors.
+import argparse
+import datetime
+import json
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function does the setup and returns
+    `(function, items)`, `function` taking no argument and processing
+    `items` items per call.
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _schemas(basic):
+    Flat = basic.struct("Flat",
+                        id=basic.Int,
+                        name=basic.Str,
+                        score=basic.Float,
+                        active=basic.Bool,
+                        created=basic.Datetime,
+                        count=basic.Int.default(0),
+                        ratio=basic.Float.default(1.),
+                        label=basic.Str.default(""),
+                        tags=basic.List[basic.Str].empty,
+                        extra=basic.Str.none)
+    flat = dict(
+        id=1,
+        name="flat",
+        score=0.5,
+        active=True,
+        created=datetime.datetime(2020, 1, 1),
+        tags=["a", "b"])
+
+    Deep = basic.struct("Leaf", value=basic.Int)
+    deep = Deep(value=1)
+    for level in range(10):
+        Deep = basic.struct(f"Level{level}", child=Deep, value=basic.Int)
+        deep = Deep(child=deep, value=level)
+
+    Wide = basic.struct(
+        "Wide", **{f"field{index}": basic.Int
+                   for index in range(200)})
+    wide = Wide(**{f"field{index}": index for index in range(200)})
+
+    Point = basic.struct("Point", x=basic.Float, y=basic.Float)
+    Lists = basic.struct("Lists",
+                         points=basic.List[Point],
+                         values=basic.List[basic.Float])
+    lists = Lists(points=[Point(x=i, y=-i) for i in range(1000)],
+                  values=[float(i) for i in range(1000)])
+    return {
+        "flat": (Flat, Flat(**flat)),
+        "deep": (Deep, deep),
+        "wide": (Wide, wide),
+        "lists": (Lists, lists),
+    }
+
+
+def _register_codecs():
+    for schema in ["flat", "deep", "wide", "lists"]:
+        for target in ["json", "bson"]:
+
+            def encode(schema=schema, target=target):
+                import basic
+                type_, value = _schemas(basic)[schema]
+                to_jsony = getattr(type_, f"to_{target}")
+                return lambda: to_jsony(value), 1
+
+            def decode(schema=schema, target=target):
+                import basic
+                type_, value = _schemas(basic)[schema]
+                jsony = getattr(type_, f"to_{target}")(value)
+                from_jsony = getattr(type_, f"from_{target}")
+                return lambda: from_jsony(jsony), 1
+
+            benchmark(f"to_{target}[{schema}]")(encode)
+            benchmark(f"from_{target}[{schema}]")(decode)
+
+        def dumps(schema=schema):
+            import basic
+            type_, value = _schemas(basic)[schema]
+            return lambda: basic.binary.dumps(type_, value), 1
+
+        def loads(schema=schema):
+            import basic
+            type_, value = _schemas(basic)[schema]
+            data = basic.binary.dumps(type_, value)
+            return lambda: basic.binary.loads(type_, data), 1
+
+        benchmark(f"binary.dumps[{schema}]")(dumps)
+        benchmark(f"binary.loads[{schema}]")(loads)
+
+
+_register_codecs()
+
+
+@benchmark("struct_new[flat]")
+def struct_new():
+    import basic
+    Flat, value = _schemas(basic)["flat"]
+    kwargs = {name: getattr(value, name) for name in ["id", "name", "score"]}
+    kwargs.update(active=True, created=value.created)
+    return lambda: Flat(**kwargs), 1
+
+
+@benchmark("struct_getattr[flat]")
+def struct_getattr():
+    import basic
+    _, value = _schemas(basic)["flat"]
+    names = ["id", "name", "score", "active", "created"] * 20
+
+    def run():
+        for name in names:
+            getattr(value, name)
+
+    return run, len(names)
+
+
+class _Model:
+    def __init__(self,
+                 layers: int,
+                 hidden: int = 128,
+                 dropout: float = 0.1,
+                 activation: str = "relu"):
+        self.layers = layers
+        self.hidden = hidden
+        self.dropout = dropout
+        self.activation = activation
+
+
+class _Optimizer:
+    def __init__(self, lr: float = 1e-3, betas=(0.9, 0.999), decay=0.):
+        self.lr = lr
+        self.betas = betas
+        self.decay = decay
+
+
+class _Job:
+    def __init__(self,
+                 model: _Model,
+                 optimizer: _Optimizer,
+                 name: str = "job",
+                 epochs: int = 10,
+                 seed: int = 0):
+        self.model = model
+        self.optimizer = optimizer
+        self.name = name
+        self.epochs = epochs
+        self.seed = seed
+
+
+@benchmark("class_type")
+def class_type():
+    from basic import inspection
+
+    # Measures a cache hit on revisions caching class_type results.
+    return lambda: inspection.class_type(_Job), 1
+
+
+@benchmark("convert")
+def convert():
+    import basic
+    JobType = basic.class_type(_Job)
+    jsony = {"model": {"layers": 4}, "optimizer": {"lr": 0.1}, "seed": 3}
+    return lambda: basic.convert(JobType, JobType.from_json(jsony)), 1
+
+
+@benchmark("parse_args")
+def parse_args():
+    import basic
+    parser = basic.ArgumentParser(basic.class_type(_Job), name="job")
+    argv = ["model.layers=4", "model.hidden=256", "optimizer.lr=0.1",
+            "epochs=3"]
+    return lambda: parser.parse_args(argv), 1
+
+
+class _Result:
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class FakeCollection:
+    """
+    In-memory stand-in for a pymongo collection, storing documents
+    as encoded BSON like a server would.
+    """
+
+    def __init__(self):
+        import bson
+        self._bson = bson
+        self._documents = {}
+
+    def insert_one(self, document):
+        document.setdefault("_id", self._bson.ObjectId())
+        self._documents[document["_id"]] = self._bson.encode(document)
+        return _Result(inserted_id=document["_id"])
+
+    def insert_many(self, documents, ordered=True):
+        ids = [self.insert_one(document).inserted_id for document in documents]
+        return _Result(inserted_ids=ids, acknowledged=True)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        decode = self._bson.decode
+        ids = (filter or {}).get("_id", {}).get("$in")
+        if ids is None:
+            return (decode(data) for data in self._documents.values())
+        return (decode(self._documents[id_]) for id_ in ids
+                if id_ in self._documents)
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        return next(iter(self.find(filter, projection)), None)
+
+    def replace_one(self, filter, document, **kwargs):
+        document["_id"] = filter["_id"]
+        self._documents[filter["_id"]] = self._bson.encode(document)
+        return _Result(matched_count=1)
+
+
+@benchmark("collection_roundtrip[flat]")
+def collection_roundtrip():
+    import basic
+    from basic import mongo
+    _, value = _schemas(basic)["flat"]
+    Flat = basic.struct("Document",
+                        _id=mongo.ObjectId.missing,
+                        **value.__class__._schema)
+    fields = value._bson
+    documents = [Flat.from_bson(dict(fields, id=i)) for i in range(100)]
+
+    def run():
+        collection = mongo.BasicCollection(FakeCollection(), Flat)
+        collection.insert_many(documents)
+        found = list(collection.find({}))
+        assert len(found) == len(documents)
+
+    return run, len(documents)
+
+
+def measure(setup, min_time=0.2, repeat=5):
+    function, items = setup()
+    timer = timeit.Timer(function)
+    number = max(1, timer.autorange()[0])
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "seconds": best,
+        "items_per_second": items / best,
+        "peak_bytes": peak,
+    }
+
+
+def run(pattern, min_time, repeat):
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern and not any(p in name for p in pattern):
+            continue
+        try:
+            results[name] = measure(setup, min_time, repeat)
+        except Exception as error:
+            results[name] = {"error": f"{error.__class__.__name__}: {error}"}
+    return results
+
+
+def _format_rate(rate):
+    for unit, scale in [("M", 1e6), ("k", 1e3)]:
+        if rate >= scale:
+            return f"{rate / scale:.1f}{unit}/s"
+    return f"{rate:.1f}/s"
+
+
+def print_table(results):
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<{width}}  error: {result['error']}")
+            continue
+        rate = _format_rate(result["items_per_second"])
+        print(f"{name:<{width}}  {rate:>10}"
+              f"  {result['peak_bytes'] / 1024:>10.1f}kB")
+
+
+def _run_revision(revision, arguments):
+    # Run this script against a worktree checked out at `revision`.
+    with tempfile.TemporaryDirectory() as directory:
+        worktree = Path(directory) / "worktree"
+        output = Path(directory) / "results.json"
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", str(worktree), revision],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL)
+        try:
+            subprocess.run([
+                sys.executable, __file__, "--path",
+                str(worktree), "--json",
+                str(output)
+            ] + arguments,
+                           check=True,
+                           stdout=subprocess.DEVNULL)
+            return json.loads(output.read_text())
+        finally:
+            subprocess.run(
+                ["git", "worktree", "remove", "--force",
+                 str(worktree)],
+                cwd=ROOT,
+                check=True)
+
+
+def compare(base_revision, revision, arguments):
+    base = _run_revision(base_revision, arguments)
+    new = _run_revision(revision, arguments)
+    width = max(len(name) for name in base)
+    print(f"{'':<{width}}  {base_revision:>10}  {revision:>10}  speedup"
+          "  memory")
+    for name in base:
+        old_result, new_result = base[name], new.get(name, {})
+        if "error" in old_result or "error" in new_result:
+            error = old_result.get("error") or new_result.get("error")
+            print(f"{name:<{width}}  error: {error}")
+            continue
+        speedup = new_result["items_per_second"] / old_result[
+            "items_per_second"]
+        memory = new_result["peak_bytes"] / max(1, old_result["peak_bytes"])
+        print(f"{name:<{width}}"
+              f"  {_format_rate(old_result['items_per_second']):>10}"
+              f"  {_format_rate(new_result['items_per_second']):>10}"
+              f"  {speedup:>6.2f}x  {memory:>5.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k",
+                        dest="pattern",
+                        action="append",
+                        help="Only run benchmarks containing this string.")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Save the results to this file.")
+    parser.add_argument("--path",
+                        default=str(ROOT),
+                        help="Directory from which basic is imported.")
+    parser.add_argument("--compare",
+                        nargs=2,
+                        metavar=("BASE", "REVISION"),
+                        help="Compare two git revisions.")
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return
+    if args.compare:
+        arguments = ["--min-time", str(args.min_time), "--repeat",
+                     str(args.repeat)]
+        for pattern in args.pattern or []:
+            arguments += ["-k", pattern]
+        compare(*args.compare, arguments)
+        return
+
+    sys.path.insert(0, args.path)
+    results = run(args.pattern, args.min_time, args.repeat)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import pytest
+
+import basic
+
+objectid = pytest.importorskip("bson.objectid")
+
+Dog = basic.struct(
+    "Dog",
+    _id=basic.ObjectId,
+    name=basic.Str.alias("n"),
+)
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find_one(self, filter=None, *args, **kwargs):
+        for document in self.documents:
+            if filter is None or filter == document["_id"]:
+                return document
+        return None
+
+
+def test_find_one_by_id_aliased():
+    oid = objectid.ObjectId()
+    collection = basic.BasicCollection(
+        FakeCollection([{"_id": oid, "n": "Laika"}]), Dog)
+    dog = collection.find_one(oid)
+    assert dog._id == oid
+    assert dog.name == "Laika"
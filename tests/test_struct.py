@@ -0,0 +1,18 @@
+import basic
+
+Keyword = basic.struct("Keyword", (), True, **{
+    "from": basic.Int,
+    "to": basic.Int.default(3),
+})
+
+
+def test_slots_keyword_fields():
+    value = Keyword.Keyword(**{"from": 1})
+    assert Keyword.to_json(value) == {"from": 1, "to": 3}
+
+
+def test_slots_keyword_fields_trusted():
+    value = Keyword.from_bson({"from": 1}, trusted=True)
+    assert Keyword.to_bson(value) == {"from": 1, "to": 3}
+    value = Keyword.from_bson({"from": 1, "to": 2}, trusted=True)
+    assert Keyword.to_bson(value) == {"from": 1, "to": 2}